@@ -1,64 +1,92 @@
+import functools
 import logging
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields, asdict, is_dataclass
 from typing import Dict, Any
 
 from dotenv import load_dotenv
-os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
-os.environ["HF_TOKEN"]  ="***"
-os.environ["HF_HOME"] = os.path.join(r"E:\dev\huggingface")
+os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
+os.environ.setdefault("HF_HOME", os.path.join(r"E:\dev\huggingface"))
 
 
-# 加载 .env 文件中的环境变量
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
+@functools.lru_cache(maxsize=None)
+def _load_env():
+    """加载 .env 文件中的环境变量（整个进程只解析一次）"""
+    load_dotenv()
+
+
+def _env(key: str, default=None):
+    """读取环境变量，首次读取时才加载 .env"""
+    _load_env()
+    return os.getenv(key, default)
+
 
 @dataclass
 class Neo4jConfig:
     """Neo4j数据库配置信息"""
-    uri:str = os.getenv("NEO4J_URI", "localhost") # 数据库URI
-    user:str = os.getenv("NEO4J_USER", "neo4j") # 数据库用户名
-    password:str = os.getenv("NEO4J_PASSWORD", "") # 数据库密码
-    driver = None # Neo4j驱动
-    database:str = os.getenv("NEO4J_DATABASE", "neo4j") # 数据库名称
+    uri:str = field(default_factory=lambda: _env("NEO4J_URI", "localhost")) # 数据库URI
+    user:str = field(default_factory=lambda: _env("NEO4J_USER", "neo4j")) # 数据库用户名
+    password:str = field(default_factory=lambda: _env("NEO4J_PASSWORD", "")) # 数据库密码
+    database:str = field(default_factory=lambda: _env("NEO4J_DATABASE", "neo4j")) # 数据库名称
+    max_connection_pool_size: int = field(default_factory=lambda: int(_env("NEO4J_MAX_POOL_SIZE") or 100)) # 驱动连接池上限
+    fetch_size: int = field(default_factory=lambda: int(_env("NEO4J_FETCH_SIZE") or 10000)) # 每批从服务端拉取的记录数
+    connection_acquisition_timeout: float = field(default_factory=lambda: float(_env("NEO4J_ACQUISITION_TIMEOUT") or 30)) # 从连接池获取连接的超时（秒）
 
 
+# 数值型配置在构建时统一转换类型，os.getenv 返回的都是字符串
 @dataclass
 class MilvusConfig:
     """Milvus数据库配置信息"""
-    host: str = os.getenv("MILVUS_HOST", "localhost") # 数据库主机
-    port: int = os.getenv("MILVUS_PORT", 19530)
-    collection_name: str = os.getenv("MILVUS_COLLECTION_NAME", "cooking_knowledge")
-    milvus_dimension: int = os.getenv("MILVUS_DIMENSION", 512)   # BGE-small-zh-v1.5的向量维度
+    host: str = field(default_factory=lambda: _env("MILVUS_HOST", "localhost")) # 数据库主机
+    port: int = field(default_factory=lambda: int(_env("MILVUS_PORT") or 19530))
+    collection_name: str = field(default_factory=lambda: _env("MILVUS_COLLECTION_NAME", "cooking_knowledge"))
+    milvus_dimension: int = field(default_factory=lambda: int(_env("MILVUS_DIMENSION") or 512))   # BGE-small-zh-v1.5的向量维度
+    hnsw_m: int = field(default_factory=lambda: int(_env("MILVUS_HNSW_M") or 16))   # HNSW每个节点的最大连接数
+    hnsw_ef_construction: int = field(default_factory=lambda: int(_env("MILVUS_HNSW_EF_CONSTRUCTION") or 200))   # HNSW建图时的候选集大小
+    # 大语料批量导入：先把行数据写成Parquet文件上传到Milvus使用的MinIO，再由bulk_import服务端导入
+    bulk_insert_threshold: int = field(default_factory=lambda: int(_env("MILVUS_BULK_INSERT_THRESHOLD") or 10000))   # 分块数达到该值时走批量导入，0表示关闭
+    bulk_import_timeout: int = field(default_factory=lambda: int(_env("MILVUS_BULK_IMPORT_TIMEOUT") or 600))   # 等待导入任务完成的最长时间（秒）
+    minio_endpoint: str = field(default_factory=lambda: _env("MINIO_ENDPOINT", "localhost:9000"))
+    minio_access_key: str = field(default_factory=lambda: _env("MINIO_ACCESS_KEY", "minioadmin"))
+    minio_secret_key: str = field(default_factory=lambda: _env("MINIO_SECRET_KEY", "minioadmin"))
+    minio_bucket: str = field(default_factory=lambda: _env("MINIO_BUCKET", "a-bucket"))   # 须与Milvus配置的minio.bucketName一致
+    minio_secure: bool = field(
+        default_factory=lambda: (_env("MINIO_SECURE") or "false").lower() in ("1", "true", "yes"))
 
 
 @dataclass
 class LLMConfig:
     """LLM配置信息"""
-    model_name: str = os.getenv("LLM_MODEL_NAME","zai-org/GLM-4.6")
-    api_key: str = os.getenv("LLM_API_KEY")
-    api_base: str = os.getenv("LLM_BASE_URL")
-    max_tokens: int = os.getenv("LLM_MAX_TOKENS", 2048) or 2048
-    temperature: float = os.getenv("LLM_TEMPERATURE", 0.1) or 0.1
-    top_k: int = os.getenv("LLM_TOP_K", 3) or 3
+    model_name: str = field(default_factory=lambda: _env("LLM_MODEL_NAME","zai-org/GLM-4.6"))
+    api_key: str = field(default_factory=lambda: _env("LLM_API_KEY"))
+    api_base: str = field(default_factory=lambda: _env("LLM_BASE_URL"))
+    max_tokens: int = field(default_factory=lambda: int(_env("LLM_MAX_TOKENS") or 2048))
+    context_window: int = field(default_factory=lambda: int(_env("LLM_CONTEXT_WINDOW") or 32768)) # 模型上下文窗口（token），超出部分的检索文档会被丢弃
+    temperature: float = field(default_factory=lambda: float(_env("LLM_TEMPERATURE") or 0.1))
+    top_k: int = field(default_factory=lambda: int(_env("LLM_TOP_K") or 3))
+    max_concurrency: int = field(default_factory=lambda: int(_env("LLM_MAX_CONCURRENCY") or 64)) # 异步请求的最大并发数
+    answer_cache_size: int = field(default_factory=lambda: int(_env("LLM_ANSWER_CACHE_SIZE") or 1024)) # 答案缓存条数，0表示关闭
+    answer_cache_ttl: int = field(default_factory=lambda: int(_env("LLM_ANSWER_CACHE_TTL") or 300)) # 答案缓存有效期（秒）
 
 
+@dataclass
 class GraphRAGConfig:
     """GraphRAG系统配置信息"""
     # Neo4j数据库配置
-    neo4j_config: Neo4jConfig = Neo4jConfig()
-    logger.debug(f"Neo4j数据库配置: {neo4j_config}")
+    neo4j_config: Neo4jConfig = field(default_factory=Neo4jConfig)
 
     # Milvus数据库配置
-    milvus_config: MilvusConfig = MilvusConfig()
+    milvus_config: MilvusConfig = field(default_factory=MilvusConfig)
     # LLM配置
-    llm_config: LLMConfig = LLMConfig()
+    llm_config: LLMConfig = field(default_factory=LLMConfig)
 
 
     # 向量模型配置
-    embedding_model_name: str = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5") or "BAAI/bge-small-zh-v1.5"
+    embedding_model_name: str = field(
+        default_factory=lambda: _env("EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5") or "BAAI/bge-small-zh-v1.5")
 
 
     # 图数据处理配置
@@ -66,17 +94,35 @@ class GraphRAGConfig:
     chunk_overlap: int = 50
     max_graph_depth: int = 2  # 图遍历最大深度
 
+    # 图索引构建时是否调用LLM为关系生成额外的主题索引键
+    enable_llm_relation_keys: bool = field(
+        default_factory=lambda: (_env("ENABLE_LLM_RELATION_KEYS") or "false").lower() in ("1", "true", "yes"))
+
+    # 本地缓存目录（分块结果等）
+    cache_dir: str = field(default_factory=lambda: _env("GRAPH_RAG_CACHE_DIR", "./cache"))
 
-    def __post_init__(self):
-        pass
 
     @classmethod
     def from_dict(cls, config_dict:Dict[str, Any]) -> "GraphRAGConfig":
-        return cls()
+        kwargs = {}
+        for f in fields(cls):
+            if f.name not in config_dict:
+                continue
+            value = config_dict[f.name]
+            # 嵌套的子配置（to_dict输出的字典）还原为对应的配置类
+            if is_dataclass(f.type) and isinstance(value, dict):
+                names = {sub.name for sub in fields(f.type)}
+                value = f.type(**{k: v for k, v in value.items() if k in names})
+            kwargs[f.name] = value
+        return cls(**kwargs)
 
     def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
-
+        return asdict(self)
 
 
-DEFAULT_CONFIG = GraphRAGConfig()
\ No newline at end of file
+def __getattr__(name):
+    # DEFAULT_CONFIG 在首次被引用时才构建
+    if name == "DEFAULT_CONFIG":
+        globals()[name] = GraphRAGConfig()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,8 @@
 import logging
+import os
 import time
-
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
 from config import GraphRAGConfig, DEFAULT_CONFIG
 from modules import GraphDataModule, LLMModule, MilvusIndexModule, HybridRetrievalModule, GraphRAGRetrievalModule, \
@@ -11,9 +12,6 @@ from modules import GraphDataModule, LLMModule, MilvusIndexModule, HybridRetriev
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 加载环境变量
-load_dotenv()
-
 
 class AdvanceGraphRAGSystem:
     """
@@ -29,130 +27,154 @@ class AdvanceGraphRAGSystem:
     def __init__(self, config:GraphRAGConfig = DEFAULT_CONFIG):
         self.config = config
 
-        # 核心模块
-        self.data_module = None
-        self.index_module = None
-        self.llm_module = None
-
-        # 检索引擎
-        self.traditional_retrieval = None
-        self.graph_retrieval = None
-        self.query_router = None
-
-
-        self.system_status = False
+        # 核心模块与检索引擎均为cached_property，首次访问时才创建
+
+        self.system_ready = False
+
+        # 知识库统计缓存：(构建代数, 统计数据)，每次构建知识库时代数加一
+        self._stats_gen = 0
+        self._stats_cache = (-1, None)
+
+    # ========== 核心模块 ==========
+
+    @cached_property
+    def data_module(self):
+        """数据准备模块"""
+        logger.info("1.初始化数据准备模块...")
+        return GraphDataModule(self.config.neo4j_config)
+
+    @cached_property
+    def index_module(self):
+        """向量索引模块"""
+        logger.info("2.初始化索引模块...")
+        return MilvusIndexModule(self.config.milvus_config,self.config.embedding_model_name)
+
+    @cached_property
+    def llm_module(self):
+        """生成模块"""
+        logger.info("3.初始化LLM模块...")
+        return LLMModule(self.config.llm_config)
+
+    # ========== 检索引擎 ==========
+
+    @cached_property
+    def traditional_retrieval(self):
+        """传统混合检索模块"""
+        logger.info("4.初始化传统混合检索...")
+        return HybridRetrievalModule(config = self.config,
+                                     milvus_module=self.index_module,
+                                     data_module= self.data_module,
+                                     llm_client= self.llm_module.client)
+
+    @cached_property
+    def graph_retrieval(self):
+        """图RAG索引模块"""
+        logger.info("5.初始化图RAG索引模块...")
+        return GraphRAGRetrievalModule(config = self.config,
+                                       llm_client= self.llm_module.client)
+
+    @cached_property
+    def query_router(self):
+        """智能查询路由"""
+        logger.info("6.初始化智能查询路由...")
+        return IntelligentQueryRouter(config = self.config,
+                                      llm_client= self.llm_module.client,
+                                      graph_retrieval= self.graph_retrieval,
+                                      traditional_retrieval= self.traditional_retrieval)
 
 
     def init_system(self):
         """
-        初始化系统
+        初始化系统：预热构建知识库必定会用到的核心模块
+        检索引擎和查询路由在首次使用时再创建
         """
 
         try:
-            # 1. 数据准备模块
-            print("1.初始化数据准备模块...")
-            self.data_module = GraphDataModule(self.config.neo4j_config)
-            # 2. 向量索引模块
-            print("2.初始化索引模块...")
-            self.index_module = MilvusIndexModule(self.config.milvus_config,self.config.embedding_model_name)
-
-            # 3. 生成模块
-            print("3.初始化LLM模块...")
-            self.llm_module = LLMModule(self.config.llm_config)
-            # 4. 传统混合检索模块
-            print("4.初始化传统混合检索...")
-            self.traditional_retrieval = HybridRetrievalModule(config = self.config,
-                                                               milvus_module=self.index_module,
-                                                               data_module= self.data_module,
-                                                               llm_client= self.llm_module.client)
-
-            #5.图RAG索引模块
-            print("5.初始化图RAG索引模块...")
-            self.graph_retrieval = GraphRAGRetrievalModule(config = self.config,
-                                                               llm_client= self.llm_module.client)
-
-            #6.智能查询路由
-            print("6.初始化智能查询路由...")
-            self.query_router = IntelligentQueryRouter(config = self.config,
-                                                               llm_client= self.llm_module.client,
-                                                               graph_retrieval= self.graph_retrieval,
-                                                               traditional_retrieval= self.traditional_retrieval)
-
-            print("✅ 高级图RAG系统初始化完成！")
+            # 数据准备、向量索引、LLM三个模块相互独立，且都阻塞在网络/模型加载上，并行初始化
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [executor.submit(getattr, self, name)
+                           for name in ("data_module", "index_module", "llm_module")]
+                for future in futures:
+                    future.result()
+
+            logger.info("✅ 高级图RAG系统初始化完成！")
         except Exception as e:
             logger.error(f"系统初始化失败: {e}")
             raise
 
     def build_knowledge_base(self):
         """构建知识库（如果需要）"""
-        print("正在构建知识库...")
+        logger.info("正在构建知识库...")
+        self._stats_gen += 1
 
         if self.index_module.has_collection():
-            print("知识库已存在，尝试加载...")
-            if self.index_module.load_collection():
-                print("📚 知识库加载成功！")
-
-                print("加载图数据以支持图检索...")
-                self.data_module.load_graph_data()
-                print("📗 构建菜谱文档")
-                self.data_module.build_recipe_documents()
-                print("进行文档分块...")
-                chunks = self.data_module.chunk_documents(
-                    chunk_size=self.config.chunk_size,
-                    chunk_overlap=self.config.chunk_overlap
-                )
-                print("构建索引...")
+            logger.info("知识库已存在，尝试加载...")
+            if self.index_module.ensure_loaded():
+                logger.info("📚 知识库加载成功！")
+
+                if self.data_module.load_cache(self._chunk_cache_path(),
+                                               self.config.chunk_size,
+                                               self.config.chunk_overlap):
+                    logger.info("📦 已从本地缓存加载图数据和文档分块")
+                    chunks = self.data_module.chunks
+                else:
+                    logger.info("加载图数据以支持图检索...")
+                    self.data_module.load_graph_data()
+                    logger.info("📗 构建菜谱文档")
+                    self.data_module.build_recipe_documents()
+                    logger.info("进行文档分块...")
+                    chunks = self.data_module.chunk_documents(
+                        chunk_size=self.config.chunk_size,
+                        chunk_overlap=self.config.chunk_overlap
+                    )
+                    self._save_chunk_cache()
+                logger.info("构建索引...")
                 self._init_retrievers(chunks)
                 return
             else:
-                print("❌ 知识库加载失败，开始重建...")
-        print("未找到已存在的集合，开始构建新的知识库...")
+                logger.warning("❌ 知识库加载失败，开始重建...")
+        logger.info("未找到已存在的集合，开始构建新的知识库...")
 
         # 从Neo4j加载图数据
-        print("从Neo4j加载图数据...")
+        logger.info("从Neo4j加载图数据...")
         self.data_module.load_graph_data()
 
         # 构建菜谱文档
-        print("构建菜谱文档...")
+        logger.info("构建菜谱文档...")
         self.data_module.build_recipe_documents ()
 
         # 文档分块
 
-        print("文档分块...")
+        logger.info("文档分块...")
         chunks = self.data_module.chunk_documents(
             chunk_size=self.config.chunk_size,
             chunk_overlap=self.config.chunk_overlap
         )
+        self._save_chunk_cache()
         # 构建Milvus 向量索引
-        print("构建Milvus 向量索引...")
+        logger.info("构建Milvus 向量索引...")
         if not self.index_module.build_vector_index(chunks):
-            print("构建Milvus 向量索引失败")
+            logger.warning("构建Milvus 向量索引失败")
         # 初始化检索器
-        self._initialize_retrievers(chunks)
+        self._init_retrievers(chunks)
 
         # 显示统计信息
         self._show_knowledge_base_stats()
 
-        print("✅ 知识库构建完成！")
-    def _init_retrievers(self, chunks):
+        logger.info("✅ 知识库构建完成！")
+    def _chunk_cache_path(self) -> str:
+        """分块缓存文件路径，与Milvus集合一一对应"""
+        return os.path.join(self.config.cache_dir, f"{self.config.milvus_config.collection_name}_chunks.pkl")
 
-        print("初始化检索引擎...")
-
-        if chunks is None:
-            chunks  = self.data_module.chunks or []
+    def _save_chunk_cache(self):
+        """持久化分块结果，下次启动时可跳过Neo4j扫描和分块"""
+        self.data_module.save_cache(self._chunk_cache_path(),
+                                    self.config.chunk_size,
+                                    self.config.chunk_overlap)
 
-        # 初始化传统检索
-        self.traditional_retrieval.initialize(chunks)
-        # 初始化图检索
-        self.graph_retrieval.initialize()
-
-        self.system_status = True
-
-        print("✅ 检索引擎初始化完成！")
-
-    def _initialize_retrievers(self, chunks):
+    def _init_retrievers(self, chunks):
         """初始化检索器"""
-        print("初始化检索引擎...")
+        logger.info("初始化检索引擎...")
 
         # 如果没有chunks，从数据模块获取
         if chunks is None:
@@ -164,35 +186,42 @@ class AdvanceGraphRAGSystem:
         # 初始化图RAG检索器
         self.graph_retrieval.initialize()
 
-        self.system_status = True
-        print("✅ 检索引擎初始化完成！")
+        self.system_ready = True
+        logger.info("✅ 检索引擎初始化完成！")
 
     def _show_knowledge_base_stats(self):
         """显示知识库统计信息"""
-        print(f"\n知识库统计:")
+        # 拼成一个字符串统一输出，避免多次写终端
+        lines = ["\n知识库统计:"]
+
+        # 知识库未重新构建时直接复用上次的统计，不再访问Milvus
+        if self._stats_cache[0] != self._stats_gen:
+            self._stats_cache = (self._stats_gen, (self.data_module.get_statistics(),
+                                                   self.index_module.get_collection_stats()))
+        stats, milvus_stats = self._stats_cache[1]
 
         # 数据统计
-        stats = self.data_module.get_statistics()
-        print(f"   菜谱数量: {stats.get('total_recipes', 0)}")
-        print(f"   食材数量: {stats.get('total_ingredients', 0)}")
-        print(f"   烹饪步骤: {stats.get('total_cooking_steps', 0)}")
-        print(f"   文档数量: {stats.get('total_documents', 0)}")
-        print(f"   文本块数: {stats.get('total_chunks', 0)}")
+        lines.append(f"   菜谱数量: {stats.get('total_recipes', 0)}")
+        lines.append(f"   食材数量: {stats.get('total_ingredients', 0)}")
+        lines.append(f"   烹饪步骤: {stats.get('total_cooking_steps', 0)}")
+        lines.append(f"   文档数量: {stats.get('total_documents', 0)}")
+        lines.append(f"   文本块数: {stats.get('total_chunks', 0)}")
 
         # Milvus统计
-        milvus_stats = self.index_module.get_collection_stats()
-        print(f"   向量索引: {milvus_stats.get('row_count', 0)} 条记录")
+        lines.append(f"   向量索引: {milvus_stats.get('row_count', 0)} 条记录")
 
         # 图RAG统计
         route_stats = self.query_router.get_route_statistics()
-        print(f"   路由统计: 总查询 {route_stats.get('total_queries', 0)} 次")
+        lines.append(f"   路由统计: 总查询 {route_stats.get('total_queries', 0)} 次")
 
         if stats.get('categories'):
             categories = list(stats['categories'].keys())[:10]
-            print(f"   🏷️ 主要分类: {', '.join(categories)}")
+            lines.append(f"   🏷️ 主要分类: {', '.join(categories)}")
+
+        print("\n".join(lines))
 
     def run_interactive(self):
-        if not self.system_status :
+        if not self.system_ready :
             print("❌系统未就绪，请先构建知识库")
             return
 
@@ -241,6 +270,12 @@ class AdvanceGraphRAGSystem:
         print("\n👋 感谢使用尝尝咸淡RAG烹饪助手！")
         self._cleanup()
 
+    def _cleanup(self):
+        """释放资源"""
+        # 只关闭已经创建过的模块，避免退出时反而触发初始化
+        if "data_module" in self.__dict__:
+            self.data_module.close()
+
     def _show_system_stats(self):
         """显示系统统计信息"""
         print("\n系统运行统计")
@@ -298,7 +333,7 @@ class AdvanceGraphRAGSystem:
         :param explain_routing: 是否解释路由
         :return: 问答结果
         """
-        if not self.system_status:
+        if not self.system_ready:
             return "系统正在初始化中，请稍后再试..."
 
         print(f"\n❓ 用户问题: {question}")
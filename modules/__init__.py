@@ -1,11 +1,17 @@
+import importlib
 
-from .graph_data_module import Neo4jConfig,GraphDataModule
-from .milvus_index_module import MilvusIndexModule
-from .graph_llm_module import LLMModule
-from .graph_index_module import GraphIndexingModule
-from .hybird_retrieval_module import HybridRetrievalModule
-from .graph_rag_retrieval_module import GraphRAGRetrievalModule
-from .query_router import IntelligentQueryRouter
+# 延迟导入：各子模块依赖neo4j、pymilvus、langchain等重量级三方库，
+# 只在首次访问对应属性时才真正导入（PEP 562）
+_LAZY = {
+    "Neo4jConfig": ".graph_data_module",
+    "GraphDataModule": ".graph_data_module",
+    "MilvusIndexModule": ".milvus_index_module",
+    "LLMModule": ".graph_llm_module",
+    "GraphIndexingModule": ".graph_index_module",
+    "HybridRetrievalModule": ".hybird_retrieval_module",
+    "GraphRAGRetrievalModule": ".graph_rag_retrieval_module",
+    "IntelligentQueryRouter": ".query_router",
+}
 
 
 __all__ = [
@@ -17,4 +23,19 @@ __all__ = [
     "GraphRAGRetrievalModule",
     "IntelligentQueryRouter",
     "LLMModule",
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module = importlib.import_module(_LAZY[name], __name__)
+    obj = getattr(module, name)
+    # 缓存到模块命名空间，后续访问不再经过__getattr__
+    globals()[name] = obj
+    return obj
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
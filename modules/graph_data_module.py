@@ -1,16 +1,148 @@
+import atexit
 import logging
+import os
+import pickle
+import re
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from statistics import fmean
+from typing import List, Dict, Any, Set, Tuple, Optional
 
 from langchain_core.documents import Document
-from neo4j import GraphDatabase
-from nltk.corpus.reader import documents
+from neo4j import GraphDatabase, READ_ACCESS
+from tqdm import tqdm
 
 from config import Neo4jConfig
 
+try:
+    import orjson
+except ImportError: # 未安装orjson时退回标准库json
+    orjson = None
+    import json
+
 logger = logging.getLogger(__name__)
 
-@dataclass
+
+def _dump_documents(docs: List[Document]) -> bytes:
+    """将文档列表序列化为JSON字节串（只保留正文和元数据）"""
+    records = [(doc.page_content, doc.metadata) for doc in docs]
+    if orjson is not None:
+        return orjson.dumps(records)
+    return json.dumps(records, ensure_ascii=False).encode("utf-8")
+
+
+def _load_documents(data: bytes) -> List[Document]:
+    """从JSON字节串还原文档列表"""
+    records = orjson.loads(data) if orjson is not None else json.loads(data)
+    return [Document(page_content=content, metadata=metadata) for content, metadata in records]
+
+
+# ========== Cypher查询 ==========
+# 查询文本定义为模块常量，每次执行都传同一个字符串，只通过参数变化
+
+# 菜谱、食材、烹饪步骤三类节点，kind列标明节点类型；
+# 属性只投影下游实际用到的字段，不传输整个properties()
+ALL_NODES_QUERY = """
+CALL {
+    MATCH (r:Recipe)
+    WHERE r.nodeId >= '200000000'
+    OPTIONAL MATCH (r)-[:BELONGS_TO_CATEGORY]->(c:Category)
+    WITH r, collect(c.name) as categories
+    RETURN 'recipe' as kind, r.nodeId as nodeId, labels(r) as labels, r.name as name,
+           r {.description, .cuisineType, .difficulty, .prepTime, .cookTime,
+              .cookingTime, .servings, .tags,
+              category: CASE WHEN size(categories) > 0
+                             THEN categories[0]
+                             ELSE COALESCE(r.category, '未知') END,
+              all_categories: CASE WHEN size(categories) > 0
+                                   THEN categories
+                                   ELSE [COALESCE(r.category, '未知')] END} as properties
+    UNION ALL
+    MATCH (i:Ingredient)
+    WHERE i.nodeId >= '200000000'
+    RETURN 'ingredient' as kind, i.nodeId as nodeId, labels(i) as labels, i.name as name,
+           i {.category, .description, .nutrition, .storage} as properties
+    UNION ALL
+    MATCH (s:CookingStep)
+    WHERE s.nodeId >= '200000000'
+    RETURN 'step' as kind, s.nodeId as nodeId, labels(s) as labels, s.name as name,
+           s {.description, .stepNumber, .methods, .tools, .timeEstimate,
+              .order, .technique, .time} as properties
+}
+RETURN kind, nodeId, labels, name, properties
+ORDER BY nodeId
+"""
+
+# 按菜谱分组的食材和步骤（一次查询覆盖全部菜谱）
+RECIPE_INGREDIENTS_QUERY = """
+UNWIND $recipe_ids AS rid
+MATCH (r:Recipe {nodeId: rid})-[req:REQUIRES]->(i:Ingredient)
+WITH rid, i, req
+ORDER BY i.name
+RETURN rid, collect({name: i.name, category: i.category,
+                     amount: req.amount, unit: req.unit,
+                     description: i.description}) as items
+"""
+RECIPE_STEPS_QUERY = """
+UNWIND $recipe_ids AS rid
+MATCH (r:Recipe {nodeId: rid})-[c:CONTAINS_STEP]->(s:CookingStep)
+WITH rid, s, c
+ORDER BY COALESCE(c.stepOrder, s.stepNumber, 999)
+RETURN rid, collect({name: s.name, description: s.description,
+                     stepNumber: s.stepNumber, methods: s.methods,
+                     tools: s.tools, timeEstimate: s.timeEstimate,
+                     stepOrder: c.stepOrder}) as items
+"""
+
+# 全图节点数和关系数，直接读取计数存储
+GRAPH_VERSION_QUERY = """
+CALL { MATCH (n) RETURN count(n) as nodeCount }
+CALL { MATCH ()-[r]->() RETURN count(r) as relCount }
+RETURN nodeCount, relCount
+"""
+
+
+# nodeId唯一约束（自带索引），与数据导入脚本中的约束同名；已存在时为空操作
+NODE_ID_CONSTRAINTS = [
+    "CREATE CONSTRAINT recipe_id_unique IF NOT EXISTS FOR (r:Recipe) REQUIRE r.nodeId IS UNIQUE",
+    "CREATE CONSTRAINT ingredient_id_unique IF NOT EXISTS FOR (i:Ingredient) REQUIRE i.nodeId IS UNIQUE",
+    "CREATE CONSTRAINT cookingstep_id_unique IF NOT EXISTS FOR (s:CookingStep) REQUIRE s.nodeId IS UNIQUE",
+]
+
+
+# 检查页缓存预热过程是否可用
+WARMUP_PROCEDURE_QUERY = """
+SHOW PROCEDURES YIELD name
+WHERE name = 'apoc.warmup.run'
+RETURN count(*) > 0 as available
+"""
+
+
+CACHE_FORMAT_VERSION = 2 # 本地缓存格式版本，缓存结构变化时递增
+
+
+_drivers: Dict[Tuple[str, str, str, int, float], Any] = {} # 进程内共享的Neo4j驱动，按连接参数缓存
+_prepared_databases: Set[Tuple[Tuple[str, str, str, int, float], str]] = set() # 已执行过准备步骤的(驱动, 数据库)
+_drivers_lock = threading.Lock()
+
+
+@atexit.register
+def _close_all_drivers():
+    """进程退出时关闭所有缓存的Neo4j驱动"""
+    with _drivers_lock:
+        for driver in _drivers.values():
+            try:
+                driver.close()
+            except Exception as e:
+                logger.warning(f"关闭Neo4j驱动失败: {e}")
+        _drivers.clear()
+        _prepared_databases.clear()
+
+
+@dataclass(slots=True)
 class GraphNode:
     """图节点数据结构"""
     node_id:str # 节点ID
@@ -18,7 +150,7 @@ class GraphNode:
     name:str  # 节点名称
     properties:Dict[str, Any] # 节点属性
 
-@dataclass
+@dataclass(slots=True)
 class GraphRelation:
     """图关系数据结构"""
     start_node_id:str # 开始节点ID
@@ -27,6 +159,77 @@ class GraphRelation:
     properties:Dict[str, Any] # 关系属性
 
 
+def _window_offsets(length: int, chunk_size: int, chunk_overlap: int) -> List[Tuple[int, int]]:
+    """
+    计算滑动窗口分块的(start, end)偏移
+
+    偏移一次性由range生成，分块时只做字符串切片
+    """
+    step = chunk_size - chunk_overlap
+    return [(start, min(start + chunk_size, length)) for start in range(0, length, step)]
+
+
+SECTION_RE = re.compile(r"\n##") # 二级标题分隔符
+
+
+def _section_offsets(content: str) -> List[Tuple[int, int]]:
+    """
+    扫描一遍文本，按二级标题计算各章节的(start, end)偏移
+
+    除第一部分外，每个章节从"##"开始（不含前面的换行符）
+    """
+    starts = [0] + [match.start() + 1 for match in SECTION_RE.finditer(content)]
+    ends = [start - 1 for start in starts[1:]] + [len(content)]
+    return list(zip(starts, ends))
+
+
+class GraphNodeTable:
+    """
+    图节点列式存储
+
+    各字段分别存放在独立的列表中（SoA），避免每个节点一个对象；
+    迭代/下标访问时按需生成GraphNode视图，兼容按行访问的下游代码
+    """
+    __slots__ = ("node_ids", "labels", "names", "properties", "id_index")
+
+    def __init__(self):
+        self.node_ids: List[str] = [] # 节点ID列
+        self.labels: List[List[str]] = [] # 节点标签列
+        self.names: List[str] = [] # 节点名称列
+        self.properties: List[Dict[str, Any]] = [] # 节点属性列
+        self.id_index: Dict[str, int] = {} # 节点ID到行号的映射
+
+    def append(self, node_id: str, labels: List[str], name: str, properties: Dict[str, Any]):
+        """追加一行节点数据"""
+        self.id_index[node_id] = len(self.node_ids)
+        self.node_ids.append(node_id)
+        # 标签来自很小的固定词表，驻留后所有节点共享同一个字符串对象
+        self.labels.append([sys.intern(label) for label in labels])
+        self.names.append(name)
+        self.properties.append(properties)
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def __iter__(self):
+        for node_id, labels, name, properties in zip(self.node_ids, self.labels, self.names, self.properties):
+            yield GraphNode(node_id=node_id, labels=labels, name=name, properties=properties)
+
+    def __getitem__(self, index: int) -> GraphNode:
+        return GraphNode(node_id=self.node_ids[index],
+                         labels=self.labels[index],
+                         name=self.names[index],
+                         properties=self.properties[index])
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.id_index
+
+    def get(self, node_id: str) -> Optional[GraphNode]:
+        """按节点ID取节点，O(1)"""
+        index = self.id_index.get(node_id)
+        return None if index is None else self[index]
+
+
 
 
 
@@ -34,37 +237,111 @@ class GraphRelation:
 class GraphDataModule:
     def __init__(self,config= Neo4jConfig):
         self.neo4j_config = config
+        self.driver = None # Neo4j驱动
+        self._read_session = None # 长连接只读会话，首次读取时创建
 
         self.documents: List[Document] = [] # 文档列表
         self.chunks: List[Document] = [] # 分块列表
-        self.recipes: List[GraphNode] = [] # 菜谱列表
-        self.ingredients: List[GraphNode] = [] # 食材列表
-        self.cooking_steps: List[GraphNode] = [] # 烹饪步骤列表
+        self.recipes = GraphNodeTable() # 菜谱列表
+        self.ingredients = GraphNodeTable() # 食材列表
+        self.cooking_steps = GraphNodeTable() # 烹饪步骤列表
 
         self._connect()
 
+    @classmethod
+    def get_driver(cls, config: Neo4jConfig):
+        """
+        获取Neo4j驱动（进程内按连接参数共享）
+
+        同一组连接参数只创建一次驱动，并且只在创建时校验一次连通性，
+        后续实例直接复用驱动及其连接池；驱动在进程退出时统一关闭。
+        加锁保证多线程并发初始化时也只创建一个驱动
+        """
+        key = (config.uri, config.user, config.password,
+               config.max_connection_pool_size, config.connection_acquisition_timeout)
+        with _drivers_lock:
+            driver = _drivers.get(key)
+            if driver is not None:
+                # 同一驱动下首次使用的数据库同样需要执行准备步骤
+                if (key, config.database) not in _prepared_databases:
+                    cls._prepare_database(driver, config.database)
+                    _prepared_databases.add((key, config.database))
+                return driver
+
+            driver = GraphDatabase.driver(config.uri,
+                                          auth=(config.user, config.password),
+                                          max_connection_pool_size=config.max_connection_pool_size,
+                                          connection_acquisition_timeout=config.connection_acquisition_timeout)
+            logger.info(f"已连接到Neo4j数据库: {config.uri}")
+
+            # 只做握手校验，不执行查询；连接问题同样会在这里尽早暴露
+            try:
+                driver.verify_connectivity()
+            except Exception:
+                driver.close()
+                raise
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Neo4j连接测试成功")
+
+            cls._prepare_database(driver, config.database)
+            _prepared_databases.add((key, config.database))
+
+            _drivers[key] = driver
+            return driver
+
+    @staticmethod
+    def _prepare_database(driver, database: str):
+        """
+        新驱动创建后执行一次：确保nodeId上有索引，并预热页缓存
+
+        两步都不是必需的，失败时只记录日志
+        """
+        try:
+            with driver.session(database=database) as session:
+                for statement in NODE_ID_CONSTRAINTS:
+                    session.run(statement).consume()
+        except Exception as e:
+            logger.warning(f"创建nodeId约束失败: {e}")
+
+        # apoc.warmup.run只存在于APOC 4.x及更早版本，APOC Core 5中已移除；
+        # 先检查过程是否存在，不存在时跳过（Neo4j 5的页缓存预热为企业版功能）
+        try:
+            with driver.session(database=database) as session:
+                record = session.run(WARMUP_PROCEDURE_QUERY).single()
+                if not record["available"]:
+                    logger.info("未安装apoc.warmup.run，跳过Neo4j页缓存预热")
+                    return
+                session.run("CALL apoc.warmup.run(true, true, true)").consume()
+            logger.info("Neo4j页缓存预热完成")
+        except Exception as e:
+            logger.warning(f"Neo4j页缓存预热失败: {e}")
+
     def _connect(self):
         """建立Neo4j连接"""
 
         try:
-            self.neo4j_config.driver = GraphDatabase.driver(
-                self.neo4j_config.uri,
-                auth=(self.neo4j_config.user, self.neo4j_config.password),
-                database=self.neo4j_config.database
-            )
-
-            logger.info(f"已连接到Neo4j数据库: {self.neo4j_config.uri}")
-
-            # 测试链接
-            with self.neo4j_config.driver.session() as session:
-                result = session.run("RETURN 1 as test")
-                _result = result.single() # 获取结果
-                if _result:
-                    logger.info("Neo4j连接测试成功")
+            self.driver = self.get_driver(self.neo4j_config)
         except Exception as e:
             logger.error(f"连接Neo4j失败: {e}")
             raise
 
+    def _read(self, work, *args, **kwargs):
+        """
+        在长连接只读会话中执行读事务
+
+        Args:
+            work: 事务函数，第一个参数为事务对象，结果需在函数内消费完
+
+        Returns:
+            事务函数的返回值
+        """
+        if self._read_session is None:
+            # 大批量拉取记录，边接收边处理，减少往返次数
+            self._read_session = self.driver.session(database=self.neo4j_config.database,
+                                                     default_access_mode=READ_ACCESS,
+                                                     fetch_size=self.neo4j_config.fetch_size)
+        return self._read_session.execute_read(work, *args, **kwargs)
+
     def load_graph_data(self)->Dict[str, Any]:
         """
         从Neo4j加载图数据
@@ -75,88 +352,7 @@ class GraphDataModule:
 
         logger.info("开始从Neo4j加载图数据...")
 
-        with self.neo4j_config.driver .session() as session:
-            # 1.加载所有菜谱节点，从Category关系中读取分类信息
-            recipes_query = """
-            MATCH (r:Recipe)
-            WHERE r.nodeId>='200000000'
-            OPTIONAL MATCH (r)-[:BELONGS_TO_CATEGORY]->(c:Category)
-            WITH r,collect(c.name) as categories 
-            RETURN r.nodeId as nodeId ,labels(r) as labels ,r.name as name,
-                   properties(r) as originalProperties,
-                   CASE WHEN size(categories) > 0
-                        THEN categories[0] 
-                        ELSE COALESCE(r.category, '未知') END as mainCategory,
-                   CASE WHEN size(categories) > 0 
-                        THEN categories 
-                        ELSE [COALESCE(r.category, '未知')] END as allCategories
-            ORDER BY r.nodeId
-            """
-
-            result = session.run(recipes_query)
-
-            self.recipes = []
-            for record in result:
-                properties = dict(record["originalProperties"])
-
-                properties["category"] = record["mainCategory"]
-                properties["all_categories"] = record["allCategories"]
-
-                node = GraphNode(
-                    node_id= record["nodeId"],
-                    labels= record["labels"],
-                    name= record["name"],
-                    properties= properties
-
-                )
-                self.recipes.append(node)
-
-            logger.info(f"成功获取到{len(self.recipes)}个菜谱节点")
-
-            # 2.加载所有食材节点
-            ingredients_query = """
-            MATCH (i:Ingredient) 
-            WHERE i.nodeId >= '200000000'
-            RETURN i.nodeId as nodeId, labels(i) as labels, i.name as name,
-                   properties(i) as properties
-            ORDER BY i.nodeId
-            """
-            result = session.run(ingredients_query)
-
-            self.ingredients = []
-            for record in result:
-                node = GraphNode(
-                    node_id=record["nodeId"],
-                    labels=record["labels"],
-                    name=record["name"],
-                    properties=record["properties"]
-                )
-                self.ingredients.append(node)
-
-            logger.info(f"获取所有食材成功！共有 {len(self.ingredients)} 个食材。")
-
-
-            # 3.加载所有烹饪步骤节点
-            steps_query = """
-            MATCH (s:CookingStep)
-            WHERE s.nodeId >= '200000000'
-            RETURN s.nodeId as nodeId, labels(s) as labels, s.name as name,
-                   properties(s) as properties
-            ORDER BY s.nodeId
-            """
-            result = session.run(steps_query)
-
-            self.cooking_steps = []
-            for record in result:
-                node = GraphNode(
-                    node_id=record["nodeId"],
-                    labels=record["labels"],
-                    name=record["name"],
-                    properties=record["properties"]
-                )
-                self.cooking_steps.append(node)
-
-            logger.info(f"加载了 {len(self.cooking_steps)} 个烹饪步骤节点")
+        self._read(self._load_all_nodes)
 
         return {
             'recipes': len(self.recipes),
@@ -164,6 +360,65 @@ class GraphDataModule:
             'cooking_steps': len(self.cooking_steps)
         }
 
+    def _load_all_nodes(self, tx):
+        """
+        一次查询加载菜谱、食材、烹饪步骤三类节点
+
+        三段查询用UNION ALL合并为一次往返，kind列标明节点类型，
+        在Python侧按类型分发到对应的列存储
+        """
+        self.recipes = GraphNodeTable()
+        self.ingredients = GraphNodeTable()
+        self.cooking_steps = GraphNodeTable()
+        tables = {
+            "recipe": self.recipes,
+            "ingredient": self.ingredients,
+            "step": self.cooking_steps,
+        }
+
+        # 直接迭代结果游标，边接收边写入列存储，不额外物化记录列表；
+        # Record本身是元组，按列顺序解包，省去逐个字段的按名查找
+        for kind, node_id, labels, name, properties in tx.run(ALL_NODES_QUERY):
+            # 投影中节点没有的属性为null，去掉后与properties()的结果一致；
+            # 菜谱分类已在查询中从Category关系算好，这里是唯一一次构建属性字典
+            tables[kind].append(node_id, labels, name,
+                                {key: value for key, value in properties.items() if value is not None})
+
+        logger.info(f"成功获取到{len(self.recipes)}个菜谱节点")
+        logger.info(f"获取所有食材成功！共有 {len(self.ingredients)} 个食材。")
+        logger.info(f"加载了 {len(self.cooking_steps)} 个烹饪步骤节点")
+
+    def get_node(self, node_id: str) -> Optional[GraphNode]:
+        """
+        按节点ID查找菜谱/食材/步骤节点
+
+        Returns:
+            节点视图，不存在时返回None
+        """
+        for table in (self.recipes, self.ingredients, self.cooking_steps):
+            node = table.get(node_id)
+            if node is not None:
+                return node
+        return None
+
+    def _fetch_grouped(self, query: str, recipe_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        在独立的只读会话中执行按菜谱分组的查询
+
+        会话不是线程安全的，并发查询时每个线程各自打开会话，
+        查询需返回rid和items两列
+
+        Returns:
+            菜谱ID到记录列表的映射
+        """
+        def _fetch(tx):
+            return {rid: items for rid, items in tx.run(query, {"recipe_ids": recipe_ids})}
+
+        with self.driver.session(database=self.neo4j_config.database,
+                                 default_access_mode=READ_ACCESS,
+                                 fetch_size=self.neo4j_config.fetch_size) as session:
+            return session.execute_read(_fetch)
+
     def build_recipe_documents(self) -> List[Document]:
         """
         构建菜谱文档，集成相关的食材和步骤信息
@@ -174,123 +429,114 @@ class GraphDataModule:
 
         logger.info("开始构建菜谱文档...")
 
-        documents = []
+        recipe_ids = list(self.recipes.node_ids)
 
-        with self.neo4j_config.driver.session() as session:
-            for recipe in self.recipes:
-                try :
-                    recipe_id = recipe.node_id
-                    recipe_name = recipe.name
-
-                    # 获取菜谱的食材列表
-                    ingredients_query = """
-                    MATCH (r:Recipe {nodeId: $recipe_id})-[req:REQUIRES]->(i:Ingredient)
-                    RETURN i.name as name, i.category as category, 
-                           req.amount as amount, req.unit as unit,
-                           i.description as description
-                    ORDER BY i.name
-                    """
-                    ingredients_result = session.run(ingredients_query, {"recipe_id": recipe_id})
-
-                    ingredients_info = []
-
-                    for ingredient in ingredients_result:
-
-                        amount  = ingredient.get("amount","")
-                        unit = ingredient.get("unit","")
-                        ingredient_text = f"{ingredient.get('name','')}"
-                        if amount and unit:
-                            ingredient_text += f"({amount}{unit})"
-                        if ingredient.get("description"):
-                            ingredient_text += f" - {ingredient.get('description')}"
-
-                        ingredients_info.append(ingredient_text)
-                    # 获取菜品烹饪步骤
-                    steps_query = """
-                    MATCH (r:Recipe {nodeId: $recipe_id})-[c:CONTAINS_STEP]->(s:CookingStep)
-                    RETURN s.name as name, s.description as description,
-                           s.stepNumber as stepNumber, s.methods as methods,
-                           s.tools as tools, s.timeEstimate as timeEstimate,
-                           c.stepOrder as stepOrder
-                    ORDER BY COALESCE(c.stepOrder, s.stepNumber, 999)
-                    """
-                    steps_result = session.run(steps_query, {"recipe_id": recipe_id})
-                    steps_info = []
-                    for step in steps_result:
-                        step_text = f"步骤: {step.get("name")}"
-                        if step.get("description"):
-                            step_text += f"\n 描述:{step.get('description')}"
-                        if step.get("methods"):
-                            step_text += f"\n 方法:{step.get('methods')}"
-                        if step.get("tools"):
-                            step_text += f"\n 工具:{step.get('tools')}"
-                        if step.get("timeEstimate"):
-                            step_text += f"\n 时间:{step.get('timeEstimate')}"
-
-                        steps_info.append(step_text)
-
-                    content_parts = [f"#{recipe_name}"]
-                    # 添加菜谱基本信息
-                    if recipe.properties.get("description"):
-                        content_parts.append(f"\n## 菜品描述\n{recipe.properties['description']}")
-
-                    if recipe.properties.get("cuisineType"):
-                        content_parts.append(f"\n菜系: {recipe.properties['cuisineType']}")
-
-                    if recipe.properties.get("difficulty"):
-                        content_parts.append(f"难度: {recipe.properties['difficulty']}星")
-
-                    if recipe.properties.get("preTime") or recipe.properties.get("cookTime") :
-
-                        time_info = []
-                        if recipe.properties.get("prepTime"):
-                            time_info.append(f"准备时间: {recipe.properties['prepTime']}")
-                        if recipe.properties.get("cookTime"):
-                            time_info.append(f"烹饪时间: {recipe.properties['cookTime']}")
-                        content_parts.append(f"\n时间信息: {', '.join(time_info)}")
-                    if recipe.properties.get("servings"):
-                        content_parts.append(f"\n份量: {recipe.properties['servings']}")
-
-                    # 添加食材信息
-                    if ingredients_info:
-                        content_parts.append("\n## 所需食材")
-                        for i, ingredient in enumerate(ingredients_info, 1):
-                            content_parts.append(f"{i}. {ingredient}")
-
-                    if steps_info:
-                        content_parts.append("\n## 制作步骤")
-                        for i, step in enumerate(steps_info, 1):
-                            content_parts.append(f"\n### 第{i}步\n{step}")
-
-                    # 添加标签信息
-                    if recipe.properties.get("tags"):
-                        content_parts.append(f"\n## 标签\n{recipe.properties['tags']}")
-
-
-                    full_content = "\n".join(content_parts)
-
-                    doc = Document(
-                        page_content= full_content,
-                        metadata={
-                                                        "node_id": recipe_id,
-                            "recipe_name": recipe_name,
-                            "node_type": "Recipe",
-                            "category": recipe.properties.get("category", "未知"),
-                            "cuisine_type": recipe.properties.get("cuisineType", "未知"),
-                            "difficulty": recipe.properties.get("difficulty", 0),
-                            "prep_time": recipe.properties.get("prepTime", ""),
-                            "cook_time": recipe.properties.get("cookTime", ""),
-                            "servings": recipe.properties.get("servings", ""),
-                            "ingredients_count": len(ingredients_info),
-                            "steps_count": len(steps_info),
-                            "doc_type": "recipe",
-                            "content_length": len(full_content)
-                        }
-                    )
-                    documents.append( doc)
-                except Exception as e:
-                    logger.warning(f"构建菜谱文档失败 {recipe_name} (ID: {recipe_id}): {e}")
-                    continue
+        # 一次性批量获取所有菜谱的食材和步骤，避免每个菜谱两次查询（N+1）
+        # 两个查询相互独立，各用一个会话并发执行，总耗时约为较慢的那一个
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            ingredients_future = executor.submit(self._fetch_grouped, RECIPE_INGREDIENTS_QUERY, recipe_ids)
+            steps_future = executor.submit(self._fetch_grouped, RECIPE_STEPS_QUERY, recipe_ids)
+            ingredients_map = ingredients_future.result()
+            steps_map = steps_future.result()
+
+        # 以下只做字符串拼装，不再访问数据库
+        documents = []
+        for recipe in self.recipes:
+            try :
+                recipe_id = recipe.node_id
+                recipe_name = recipe.name
+
+                # 菜谱的食材列表
+                ingredients_info = []
+
+                for ingredient in ingredients_map.get(recipe_id, []):
+
+                    amount  = ingredient.get("amount","")
+                    unit = ingredient.get("unit","")
+                    parts = [f"{ingredient.get('name','')}"]
+                    if amount and unit:
+                        parts.append(f"({amount}{unit})")
+                    if ingredient.get("description"):
+                        parts.append(f" - {ingredient.get('description')}")
+
+                    ingredients_info.append("".join(parts))
+                # 菜品烹饪步骤
+                steps_info = []
+                for step in steps_map.get(recipe_id, []):
+                    parts = [f"步骤: {step.get('name')}"]
+                    if step.get("description"):
+                        parts.append(f"\n 描述:{step.get('description')}")
+                    if step.get("methods"):
+                        parts.append(f"\n 方法:{step.get('methods')}")
+                    if step.get("tools"):
+                        parts.append(f"\n 工具:{step.get('tools')}")
+                    if step.get("timeEstimate"):
+                        parts.append(f"\n 时间:{step.get('timeEstimate')}")
+
+                    steps_info.append("".join(parts))
+
+                content_parts = [f"#{recipe_name}"]
+                # 添加菜谱基本信息
+                if recipe.properties.get("description"):
+                    content_parts.append(f"\n## 菜品描述\n{recipe.properties['description']}")
+
+                if recipe.properties.get("cuisineType"):
+                    content_parts.append(f"\n菜系: {recipe.properties['cuisineType']}")
+
+                if recipe.properties.get("difficulty"):
+                    content_parts.append(f"难度: {recipe.properties['difficulty']}星")
+
+                if recipe.properties.get("preTime") or recipe.properties.get("cookTime") :
+
+                    time_info = []
+                    if recipe.properties.get("prepTime"):
+                        time_info.append(f"准备时间: {recipe.properties['prepTime']}")
+                    if recipe.properties.get("cookTime"):
+                        time_info.append(f"烹饪时间: {recipe.properties['cookTime']}")
+                    content_parts.append(f"\n时间信息: {', '.join(time_info)}")
+                if recipe.properties.get("servings"):
+                    content_parts.append(f"\n份量: {recipe.properties['servings']}")
+
+                # 添加食材信息
+                if ingredients_info:
+                    content_parts.append("\n## 所需食材")
+                    for i, ingredient in enumerate(ingredients_info, 1):
+                        content_parts.append(f"{i}. {ingredient}")
+
+                if steps_info:
+                    content_parts.append("\n## 制作步骤")
+                    for i, step in enumerate(steps_info, 1):
+                        content_parts.append(f"\n### 第{i}步\n{step}")
+
+                # 添加标签信息
+                if recipe.properties.get("tags"):
+                    content_parts.append(f"\n## 标签\n{recipe.properties['tags']}")
+
+
+                full_content = "\n".join(content_parts)
+
+                doc = Document(
+                    page_content= full_content,
+                    metadata={
+                        "node_id": recipe_id,
+                        "recipe_name": recipe_name,
+                        "node_type": "Recipe",
+                        "category": recipe.properties.get("category", "未知"),
+                        "cuisine_type": recipe.properties.get("cuisineType", "未知"),
+                        "difficulty": recipe.properties.get("difficulty", 0),
+                        "prep_time": recipe.properties.get("prepTime", ""),
+                        "cook_time": recipe.properties.get("cookTime", ""),
+                        "servings": recipe.properties.get("servings", ""),
+                        "ingredients_count": len(ingredients_info),
+                        "steps_count": len(steps_info),
+                        "doc_type": "recipe",
+                        "content_length": len(full_content)
+                    }
+                )
+                documents.append( doc)
+            except Exception as e:
+                logger.warning(f"构建菜谱文档失败 {recipe_name} (ID: {recipe_id}): {e}")
+                continue
 
         self.documents = documents
         logger.info(f"构建菜谱文档完成，共 {len(documents)} 个")
@@ -302,80 +548,75 @@ class GraphDataModule:
         """
         logger.info("开始对文档进行分块处理...")
 
-        if not documents:
+        if not self.documents:
             raise ValueError("请先构建文档")
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"分块参数无效: chunk_size={chunk_size}, chunk_overlap={chunk_overlap}")
 
         chunks = []
         chunk_id = 0
-        for doc in self.documents:
+        # 非交互终端（日志重定向、后台运行）下不显示进度条
+        for doc in tqdm(self.documents, desc="文档分块", disable=not sys.stderr.isatty()):
 
             content = doc.page_content
+            length = len(content)
+            node_id = doc.metadata["node_id"]
+            # 每个父文档只展开一次元数据，各分块在此基础上只补充自己的字段
+            base_meta = {**doc.metadata, "parent_id": node_id, "doc_type": "chunk"}
 
             # 简单的分块处理
-            if len(content)<= chunk_size:
+            if length <= chunk_size:
                 chunk = Document(
                     page_content=content,
-                    metadata={
-                        **doc.metadata,
-                        "chunk_id": f"{doc.metadata['node_id']}_chunk_{chunk_id}",
-                        "parent_id": doc.metadata["node_id"],
+                    metadata=base_meta | {
+                        "chunk_id": f"{node_id}_chunk_{chunk_id}",
                         "chunk_index": 0,
                         "total_chunks": 1,
-                        "chunk_size": len(content),
-                        "doc_type": "chunk"
+                        "chunk_size": length
                     }
                 )
                 chunks.append(chunk)
                 chunk_id += 1
             else:
                 # 按照章节处理
-                sections = content.split("\n##")
+                sections = _section_offsets(content)
                 if len(sections) <=1 :
                     # 没有二级标题，按长度强制分块
-                    total_chunks = (len(content)-1)//(chunk_size-chunk_overlap)+1
+                    offsets = _window_offsets(length, chunk_size, chunk_overlap)
+                    base_meta["total_chunks"] = len(offsets)
 
-                    for i in range(total_chunks):
-                        start = i * (chunk_size-chunk_overlap)
-                        end = min(start + chunk_size, len(content))
-
-                        chunk_content  = content[start:end]
+                    for i, (start, end) in enumerate(offsets):
                         chunk = Document(
-                            page_content=chunk_content,
-                            metadata={
-                                **doc.metadata,
-                                "chunk_id": f"{doc.metadata['node_id']}_chunk_{chunk_id}",
-                                "parent_id": doc.metadata["node_id"],
+                            page_content=content[start:end],
+                            metadata=base_meta | {
+                                "chunk_id": f"{node_id}_chunk_{chunk_id}",
                                 "chunk_index": i,
-                                "total_chunks": total_chunks,
-                                "chunk_size": len(chunk_content),
-                                "doc_type": "chunk"
+                                "chunk_size": end - start
                             }
                         )
                         chunks.append(chunk)
                         chunk_id+=1
                 else:
-                    # 按照章节分块
-                    total_chunks = len(sections)
+                    # 按照章节分块，每个章节只切片一次；除第一部分外都以"##"标题开头
+                    base_meta["total_chunks"] = len(sections)
+
+                    for i, (start, end) in enumerate(sections):
+                        chunk_content = content[start:end]
 
-                    for i,section in enumerate(sections):
                         if i == 0:
                             # 第一部分包含标题
-                            chunk_content = section
+                            section_title = "主标题"
                         else:
-                            # 其他部分添加标题
-                            chunk_content = f"## {section}"
+                            title_end = content.find("\n", start, end)
+                            section_title = content[start + 2:title_end if title_end != -1 else end].strip()
 
                         chunk = Document(
                             page_content=chunk_content,
-                            metadata={
-                                **doc.metadata,
-                                "chunk_id": f"{doc.metadata['node_id']}_chunk_{chunk_id}",
-                                "parent_id": doc.metadata["node_id"],
+                            metadata=base_meta | {
+                                "chunk_id": f"{node_id}_chunk_{chunk_id}",
                                 "chunk_index": i,
-                                "total_chunks": total_chunks,
-                                "chunk_size": len(chunk_content),
-                                "doc_type": "chunk",
-                                "section_title": section.split('\n')[0] if i > 0 else "主标题"
+                                "chunk_size": end - start,
+                                "section_title": section_title
                             }
                         )
                         chunks.append(chunk)
@@ -384,6 +625,87 @@ class GraphDataModule:
         logger.debug(f"文档分块完成，文档分块数: {len(chunks)}")
         return chunks
 
+    def get_graph_version(self) -> str:
+        """
+        获取图数据版本，用于判断本地缓存是否过期
+
+        节点数和关系数直接读取Neo4j的计数存储，开销很小
+
+        Returns:
+            图数据版本字符串
+        """
+        record = self._read(lambda tx: tx.run(GRAPH_VERSION_QUERY).single())
+        return f"{record['nodeCount']}_{record['relCount']}"
+
+    def save_cache(self, path: str, chunk_size: int, chunk_overlap: int):
+        """
+        将图节点、文档和分块结果持久化到本地缓存文件
+
+        Args:
+            path: 缓存文件路径
+            chunk_size: 分块大小
+            chunk_overlap: 分块重叠大小
+        """
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            payload = {
+                "format_version": CACHE_FORMAT_VERSION,
+                "graph_version": self.get_graph_version(),
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "recipes": self.recipes,
+                "ingredients": self.ingredients,
+                "cooking_steps": self.cooking_steps,
+                # 文档和分块是大量小字典，用JSON记录代替逐个pickle Document对象
+                "documents": _dump_documents(self.documents),
+                "chunks": _dump_documents(self.chunks)
+            }
+            # 先写临时文件再替换，避免中断时留下损坏的缓存
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(payload, f, protocol=5)
+            os.replace(tmp_path, path)
+            logger.info(f"已保存分块缓存: {path}")
+        except Exception as e:
+            logger.warning(f"保存分块缓存失败: {e}")
+
+    def load_cache(self, path: str, chunk_size: int, chunk_overlap: int) -> bool:
+        """
+        从本地缓存文件加载图节点、文档和分块结果
+
+        Args:
+            path: 缓存文件路径
+            chunk_size: 分块大小
+            chunk_overlap: 分块重叠大小
+
+        Returns:
+            缓存是否命中且有效
+        """
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with open(path, "rb") as f:
+                payload = pickle.load(f)
+
+            if (payload.get("format_version") != CACHE_FORMAT_VERSION
+                    or payload.get("chunk_size") != chunk_size
+                    or payload.get("chunk_overlap") != chunk_overlap
+                    or payload.get("graph_version") != self.get_graph_version()):
+                logger.info("分块缓存已过期")
+                return False
+
+            self.recipes = payload["recipes"]
+            self.ingredients = payload["ingredients"]
+            self.cooking_steps = payload["cooking_steps"]
+            self.documents = _load_documents(payload["documents"])
+            self.chunks = _load_documents(payload["chunks"])
+            logger.info(f"已加载分块缓存: {path}，共 {len(self.chunks)} 个分块")
+            return True
+        except Exception as e:
+            logger.warning(f"加载分块缓存失败: {e}")
+            return False
+
     def get_statistics(self) -> Dict[str, Any]:
         """
         获取数据统计信息
@@ -401,33 +723,25 @@ class GraphDataModule:
 
         if self.documents:
             # 分类统计
-            categories = {}
-            cuisines = {}
-            difficulties = {}
-
-            for doc in self.documents:
-                category = doc.metadata.get('category', '未知')
-                categories[category] = categories.get(category, 0) + 1
-
-                cuisine = doc.metadata.get('cuisine_type', '未知')
-                cuisines[cuisine] = cuisines.get(cuisine, 0) + 1
-
-                difficulty = doc.metadata.get('difficulty', 0)
-                difficulties[str(difficulty)] = difficulties.get(str(difficulty), 0) + 1
+            metadatas = [doc.metadata for doc in self.documents]
+            categories = Counter(meta.get('category', '未知') for meta in metadatas)
+            cuisines = Counter(meta.get('cuisine_type', '未知') for meta in metadatas)
+            difficulties = Counter(str(meta.get('difficulty', 0)) for meta in metadatas)
 
             stats.update({
-                'categories': categories,
-                'cuisines': cuisines,
-                'difficulties': difficulties,
-                'avg_content_length': sum(doc.metadata.get('content_length', 0) for doc in self.documents) / len(
-                    self.documents),
-                'avg_chunk_size': sum(chunk.metadata.get('chunk_size', 0) for chunk in self.chunks) / len(
-                    self.chunks) if self.chunks else 0
+                'categories': dict(categories),
+                'cuisines': dict(cuisines),
+                'difficulties': dict(difficulties),
+                'avg_content_length': fmean(meta.get('content_length', 0) for meta in metadatas),
+                'avg_chunk_size': fmean(chunk.metadata.get('chunk_size', 0) for chunk in self.chunks) if self.chunks else 0
             })
 
         return stats
     def close(self):
-        """关闭Neo4j连接"""
-        if hasattr(self.neo4j_config, 'driver') and self.neo4j_config.driver:
-            self.neo4j_config.driver.close()
-            logger.info("已关闭Neo4j连接")
+        """释放Neo4j连接（驱动为进程内共享，实际关闭在进程退出时进行）"""
+        if self._read_session:
+            self._read_session.close()
+            self._read_session = None
+        if self.driver:
+            self.driver = None
+            logger.info("已释放Neo4j连接")
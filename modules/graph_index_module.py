@@ -1,13 +1,35 @@
+import hashlib
 import json
 import logging
+import os
+import re
+import sqlite3
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, List, Any, Tuple
 
 from langchain_core.documents import Document
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError: # 未安装orjson时退回标准库json
+    _json_loads = json.loads
+
 logger = logging.getLogger(__name__)
 
+LLM_KEY_BATCH_SIZE = 32 # 每次LLM请求处理的关系数量
+LLM_KEY_MAX_WORKERS = 4 # 并发的LLM请求数
+
+
+def _as_keyword_list(value: Any) -> List[str]:
+    """校验LLM返回的关键词：只接受由字符串组成的列表，其他结构视为无效返回空列表"""
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    return []
+
 @dataclass
 class EntityKeyValue:
     """实体键值对"""
@@ -50,8 +72,15 @@ class GraphIndexingModule:
         self.relation_kv_store: Dict[str, RelationKeyValue] = {} # 关系键值对
 
         #索引 key -> entity/relation IDs
-        self.key_to_entities: Dict[str, List[str]] =  defaultdict(list)
-        self.key_to_relations: Dict[str, List[str]] =  defaultdict(list)
+        # 用dict充当有序集合：O(1)去重，同时保持插入顺序，检索结果顺序稳定
+        self.key_to_entities: Dict[str, Dict[str, None]] =  defaultdict(dict)
+        self.key_to_relations: Dict[str, Dict[str, None]] =  defaultdict(dict)
+
+        # 关系索引键缓存：同样的(关系类型, 源实体, 目标实体)组合只生成一次，包括LLM增强的键
+        self._relation_keys_cached = lru_cache(maxsize=4096)(self._relation_keys)
+        # LLM增强关系键：(关系类型, 源名称, 源类型, 目标名称, 目标类型) -> 关键词列表
+        self._llm_relation_keys: Dict[Tuple[str, str, str, str, str], List[str]] = {}
+        self._llm_key_db = None # LLM关系键的本地持久化缓存（sqlite），首次使用时打开
 
 
     def create_entity_key_values(self,
@@ -94,7 +123,7 @@ class GraphIndexingModule:
                                        })
 
             self.entity_kv_store[entity_id] = entity_kv
-            self.key_to_entities[entity_name].append(entity_id)
+            self.key_to_entities[entity_name][entity_id] = None
 
         # 打印第一个节点
         if self.entity_kv_store:
@@ -124,7 +153,7 @@ class GraphIndexingModule:
                                                    "properties":getattr(ingredient, "properties", {})
                                                })
                     self.entity_kv_store[entity_id] = entity_kv
-                    self.key_to_entities[entity_name].append(entity_id)
+                    self.key_to_entities[entity_name][entity_id] = None
 
             # 处理烹饪步骤
         for cooking_step in cooking_steps:
@@ -154,7 +183,7 @@ class GraphIndexingModule:
                                            }
                 )
                 self.entity_kv_store[entity_id] = entity_kv
-                self.key_to_entities[entity_name].append(entity_id)
+                self.key_to_entities[entity_name][entity_id] = None
 
         logger.info(f"实体键值对创建完成，共 {len(self.entity_kv_store)} 个实体")
         return self.entity_kv_store
@@ -167,6 +196,9 @@ class GraphIndexingModule:
         """
         logger.info("开始创建关系键值对...")
 
+        if self.config.enable_llm_relation_keys:
+            self._prefetch_llm_relation_keys(relationships)
+
         for i , (source_id, relation_type,target_id) in enumerate(relationships):
             relation_id = f"rel_{i}_{source_id}_{target_id}"
 
@@ -209,12 +241,12 @@ class GraphIndexingModule:
 
             # 为每个索引建立映射
             for key in index_keys:
-                self.key_to_relations[key].append(relation_id)
+                self.key_to_relations[key][relation_id] = None
 
 
         # 打印 key_to_relations前三个键值对
         for key, value in list(self.key_to_relations.items())[:3]:
-            logger.info(f"key_to_relations: {key} -> {value}")
+            logger.info(f"key_to_relations: {key} -> {list(value)}")
 
         logger.info(f"关系键值对创建完成，共 {len(self.relation_kv_store)} 个关系")
 
@@ -227,6 +259,14 @@ class GraphIndexingModule:
         """
         为关系生成多个索引键，包含全局主题
         """
+        return list(self._relation_keys_cached(relation_type,
+                                               source_entity.entity_name, source_entity.entity_type,
+                                               target_entity.entity_name, target_entity.entity_type))
+
+    def _relation_keys(self, relation_type, source_name, source_type, target_name, target_type) -> Tuple[str, ...]:
+        """
+        生成关系索引键（结果由lru_cache缓存，因此返回不可变的元组）
+        """
         keys = [relation_type]
 
         # 根据关系类型和实体类型生成主题键
@@ -235,15 +275,15 @@ class GraphIndexingModule:
             keys.extend( [
                 "食材搭配",
                 "烹饪原料",
-                f"{source_entity.entity_name}_食材",
-                target_entity.entity_name
+                f"{source_name}_食材",
+                target_name
             ])
         elif relation_type == "HAS_STEP" :
             # 菜谱-步骤关系的主题键
             keys.extend( [
                 "制作步骤",
                 "烹饪过程",
-                f"{source_entity.entity_name}_步骤",
+                f"{source_name}_步骤",
                 "制作方法"
             ])
         elif relation_type == "BELONGS_TO_CATEGORY":
@@ -251,26 +291,35 @@ class GraphIndexingModule:
             keys.extend([
                 "菜品分类",
                 "美食类别",
-                target_entity.entity_name
+                target_name
             ])
 
         # 使用LLm增强关系索引键
-        if getattr(self.config, "enable_llm_relation_keys", False):
-            enhanced_keys = self._llm_enhance_relation_keys(source_entity, target_entity, relation_type)
+        if self.config.enable_llm_relation_keys:
+            combo = (relation_type, source_name, source_type, target_name, target_type)
+            enhanced_keys = self._llm_relation_keys.get(combo)
+            if enhanced_keys is None:
+                # 未经批量预取的关系，单独请求一次
+                enhanced_keys = self._load_persisted_llm_keys([combo]).get(combo)
+                if enhanced_keys is None:
+                    enhanced_keys = self._llm_enhance_relation_keys(source_name, source_type,
+                                                                    target_name, target_type, relation_type)
+                    self._persist_llm_keys({combo: enhanced_keys})
+                self._llm_relation_keys[combo] = enhanced_keys
             keys.extend(enhanced_keys)
 
 
-        return list(set(keys))
+        return tuple(set(keys))
 
-    def _llm_enhance_relation_keys(self, source_entity, target_entity, relation_type):
+    def _llm_enhance_relation_keys(self, source_name, source_type, target_name, target_type, relation_type):
         """
                 使用LLM增强关系索引键，生成全局主题
                 """
         prompt = f"""
                 分析以下实体关系，生成相关的主题关键词：
 
-                源实体: {source_entity.entity_name} ({source_entity.entity_type})
-                目标实体: {target_entity.entity_name} ({target_entity.entity_type})
+                源实体: {source_name} ({source_type})
+                目标实体: {target_name} ({target_type})
                 关系类型: {relation_type}
 
                 请生成3-5个相关的主题关键词，用于索引和检索。
@@ -285,13 +334,137 @@ class GraphIndexingModule:
                 max_tokens=200
             )
 
-            result = json.loads(response.choices[0].message.content.strip())
-            return result.get("keywords", [])
+            result = _json_loads(response.choices[0].message.content.strip())
+            return _as_keyword_list(result.get("keywords")) if isinstance(result, dict) else []
 
         except Exception as e:
             logger.error(f"LLM增强关系索引键失败: {e}")
             return []
 
+    def _prefetch_llm_relation_keys(self, relationships: List[Tuple[str, str, str]]):
+        """
+        批量预取LLM增强关系键
+
+        收集尚未缓存的(关系类型, 源实体, 目标实体)组合，每LLM_KEY_BATCH_SIZE个合并为一次请求，
+        多个批次并发发送，结果写入self._llm_relation_keys
+        """
+        pending = {}
+        for source_id, relation_type, target_id in relationships:
+            source_entity = self.entity_kv_store.get(source_id)
+            target_entity = self.entity_kv_store.get(target_id)
+            if not source_entity or not target_entity:
+                continue
+            combo = (relation_type,
+                     source_entity.entity_name, source_entity.entity_type,
+                     target_entity.entity_name, target_entity.entity_type)
+            if combo not in self._llm_relation_keys:
+                pending[combo] = None
+
+        if not pending:
+            return
+
+        # 先查本地持久化缓存，命中的不再请求LLM
+        persisted = self._load_persisted_llm_keys(list(pending))
+        self._llm_relation_keys.update(persisted)
+        combos = [combo for combo in pending if combo not in persisted]
+        if not combos:
+            logger.info(f"LLM关系索引键全部命中本地缓存: {len(persisted)} 个关系")
+            return
+
+        batches = [combos[i:i + LLM_KEY_BATCH_SIZE] for i in range(0, len(combos), LLM_KEY_BATCH_SIZE)]
+        logger.info(f"批量生成LLM关系索引键: {len(combos)} 个关系，{len(batches)} 次请求")
+
+        with ThreadPoolExecutor(max_workers=LLM_KEY_MAX_WORKERS) as executor:
+            for batch, keywords in zip(batches, executor.map(self._llm_enhance_relation_keys_batch, batches)):
+                results = {combo: _as_keyword_list(keywords.get(str(i))) for i, combo in enumerate(batch)}
+                self._llm_relation_keys.update(results)
+                self._persist_llm_keys(results)
+
+    def _llm_key_store(self):
+        """打开（必要时创建）LLM关系键的sqlite缓存"""
+        if self._llm_key_db is None:
+            cache_dir = self.config.cache_dir
+            os.makedirs(cache_dir, exist_ok=True)
+            self._llm_key_db = sqlite3.connect(os.path.join(cache_dir, "llm_relation_keys.sqlite"),
+                                               check_same_thread=False)
+            self._llm_key_db.execute(
+                "CREATE TABLE IF NOT EXISTS relation_keys (key TEXT PRIMARY KEY, keywords TEXT NOT NULL)")
+        return self._llm_key_db
+
+    def _llm_key_digest(self, combo: Tuple[str, str, str, str, str]) -> str:
+        """缓存键：模型名称与关系内容的sha256，换模型后自动失效"""
+        payload = json.dumps([self.config.llm_config.model_name, *combo], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load_persisted_llm_keys(self, combos: List[Tuple[str, str, str, str, str]]) -> Dict[Tuple[str, str, str, str, str], List[str]]:
+        """从本地缓存读取LLM关系键，只返回命中的组合"""
+        try:
+            digests = {self._llm_key_digest(combo): combo for combo in combos}
+            db = self._llm_key_store()
+            found = {}
+            digest_list = list(digests)
+            # 分批查询，避免超出sqlite的参数个数上限
+            for i in range(0, len(digest_list), 500):
+                part = digest_list[i:i + 500]
+                rows = db.execute(f"SELECT key, keywords FROM relation_keys WHERE key IN ({','.join('?' * len(part))})",
+                                  part)
+                for key, keywords in rows:
+                    found[digests[key]] = _json_loads(keywords)
+            return found
+        except Exception as e:
+            logger.warning(f"读取LLM关系键缓存失败: {e}")
+            return {}
+
+    def _persist_llm_keys(self, results: Dict[Tuple[str, str, str, str, str], List[str]]):
+        """写入LLM关系键缓存；空结果通常意味着请求失败，不写入以便下次重试"""
+        rows = [(self._llm_key_digest(combo), json.dumps(keywords, ensure_ascii=False))
+                for combo, keywords in results.items() if keywords]
+        if not rows:
+            return
+        try:
+            db = self._llm_key_store()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO relation_keys (key, keywords) VALUES (?, ?)", rows)
+        except Exception as e:
+            logger.warning(f"写入LLM关系键缓存失败: {e}")
+
+    def _llm_enhance_relation_keys_batch(self, batch: List[Tuple[str, str, str, str, str]]) -> Dict[str, List[str]]:
+        """
+        一次请求为多条关系生成主题关键词
+
+        Returns:
+            关系序号（字符串）到关键词列表的映射，失败时返回空字典
+        """
+        lines = [f"{i}. 源实体: {source_name} ({source_type}) -> 目标实体: {target_name} ({target_type})，关系类型: {relation_type}"
+                 for i, (relation_type, source_name, source_type, target_name, target_type) in enumerate(batch)]
+        prompt = f"""
+                分析以下实体关系，为每条关系生成3-5个相关的主题关键词，用于索引和检索：
+
+                {chr(10).join(lines)}
+
+                按关系序号返回JSON格式：{{"0": ["关键词1", "关键词2"], "1": ["关键词1", "关键词2"]}}
+                """
+
+        try:
+            response = self.llm_client.chat.completions.create(
+                model=self.config.llm_config.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,
+                max_tokens=60 * len(batch)
+            )
+
+            content = response.choices[0].message.content.strip()
+            # 兼容模型用```json代码块包裹结果
+            match = re.search(r'```(?:json)?(.*?)```', content, re.DOTALL)
+            if match:
+                content = match.group(1)
+            result = _json_loads(content)
+            return result if isinstance(result, dict) else {}
+
+        except Exception as e:
+            logger.error(f"LLM批量增强关系索引键失败: {e}")
+            return {}
+
     def deduplicate_entities_and_relations(self):
         """
         去重相同的实体和关系，优化图操作
@@ -364,21 +537,21 @@ class GraphIndexingModule:
             # 重建实体映射
             for entity_id,entity_kv in self.entity_kv_store.items():
                 for key in entity_kv.index_keys:
-                    self.key_to_entities[key].append(entity_id)
+                    self.key_to_entities[key][entity_id] = None
             # 重建关系映射
             for relation_id,relation_kv in self.relation_kv_store.items():
                 for key in relation_kv.index_keys:
-                    self.key_to_relations[key].append(relation_id)
+                    self.key_to_relations[key][relation_id] = None
 
     def get_entities_by_key(self, key):
         """根据索引键获取实体"""
-        entity_ids = self.key_to_entities.get(key, [])
+        entity_ids = self.key_to_entities.get(key, {})
         return [self.entity_kv_store[eid] for eid in entity_ids if eid in self.entity_kv_store]
 
     def get_relations_by_key(self, key: str) -> List[RelationKeyValue]:
         """根据索引键获取关系"""
         """根据索引键获取关系"""
-        relation_ids = self.key_to_relations.get(key, [])
+        relation_ids = self.key_to_relations.get(key, {})
         return [self.relation_kv_store[rid] for rid in relation_ids if rid in self.relation_kv_store]
 
 
@@ -1,13 +1,61 @@
+import asyncio
+import hashlib
 import logging
+import random
+import threading
 import time
-from typing import List
+import weakref
+from functools import cached_property
+from typing import List, Optional, Tuple
 
+import httpx
+from cachetools import TTLCache
 from langchain_core.documents import Document
 
 from config import LLMConfig
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+
+try:
+    import tiktoken
+except ImportError: # 未安装tiktoken时按字符数估算token数
+    tiktoken = None
+
 logger = logging.getLogger(__name__)
 
+# 可重试的HTTP状态码：限流、服务端错误及服务过载，其余（鉴权、参数错误等）直接失败
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504, 529})
+# 退避等待上限（秒）
+MAX_BACKOFF = 30.0
+
+# LightRAG风格的统一提示词模板
+PROMPT_TMPL = """
+作为一位专业的烹饪助手，请基于以下信息回答用户的问题。
+
+检索到的相关信息：
+{context}
+
+用户问题：{question}
+
+请提供准确、实用的回答。根据问题的性质：
+- 如果是询问多个菜品，请提供清晰的列表
+- 如果是询问具体制作方法，请提供详细步骤
+- 如果是一般性咨询，请提供综合性回答
+
+回答：
+"""
+
+
+def _is_retryable(error: Exception) -> bool:
+    """判断异常是否为可重试的临时错误（超时属于APIConnectionError子类）"""
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+
+def _backoff_delay(attempt: int) -> float:
+    """带随机抖动的指数退避，避免多个请求同时重试"""
+    return min(random.uniform(2, 4) * (2 ** attempt), MAX_BACKOFF)
+
 class LLMModule:
     """LLM模块 - 负责LLM模型调用"""
     def __init__(self,config:LLMConfig):
@@ -15,102 +63,270 @@ class LLMModule:
         if not self.config.api_key:
             raise ValueError("LLM API KEY不能为空")
 
+        # 关闭SDK内置重试，重试统一由_is_retryable/_backoff_delay控制，避免两层重试叠加
         self.client  = OpenAI(api_key=self.config.api_key,
 
                                   base_url = self.config.api_base,
 
+                                  max_retries=0,
+
                                   # top_k=self.config.top_k or 3
                                   )
+        # 异步客户端和并发信号量都与事件循环绑定，按循环分别创建
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._semaphores = weakref.WeakKeyDictionary()
+        # 答案缓存：相同提示词（问题+检索上下文）在有效期内直接复用回答
+        self._answer_cache = TTLCache(maxsize=self.config.answer_cache_size,
+                                      ttl=self.config.answer_cache_ttl) if self.config.answer_cache_size > 0 else None
+        self._answer_cache_lock = threading.Lock()
         logger.info(f"已初始化LLM模型: {self.config.model_name}")
 
-    def generate_adaptive_answer(self, question: str, documents: List[Document]) -> str:
+    @cached_property
+    def _token_encoder(self):
+        """token编码器，无法获取时返回None（退回按字符数估算）"""
+        if tiktoken is None:
+            return None
+        try:
+            try:
+                return tiktoken.encoding_for_model(self.config.model_name)
+            except KeyError: # 非OpenAI模型没有对应编码，用通用编码近似
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"加载token编码器失败，改为按字符数估算: {e}")
+            return None
+
+    def _count_tokens(self, text: str) -> int:
+        """统计文本token数"""
+        encoder = self._token_encoder
+        if encoder is None:
+            return len(text)
+        return len(encoder.encode(text, disallowed_special=()))
+
+    def _truncate_tokens(self, text: str, max_tokens: int) -> str:
+        """将文本截断到指定token数以内"""
+        encoder = self._token_encoder
+        if encoder is None:
+            return text[:max_tokens]
+        return encoder.decode(encoder.encode(text, disallowed_special=())[:max_tokens])
+
+    def _build_context(self, documents: List[Document], token_budget: int) -> str:
+        """
+        拼接检索文档作为上下文，带检索层级的文档加上层级前缀
+
+        文档按检索排序依次加入，超出token预算时丢弃其余排名靠后的文档
+        """
+        context_parts = []
+        used_tokens = 0
+        for index, doc in enumerate(documents):
+            content = doc.page_content.strip()
+            if not content:
+                continue
+            level = doc.metadata.get('retrieval_level', '')
+            part = f"[{level.upper()}] {content}" if level else content
+
+            tokens = self._count_tokens(part) + 1 # 加上分隔符
+            if used_tokens + tokens > token_budget:
+                # 第一篇文档就超出预算时截断保留，避免上下文为空
+                if not context_parts and token_budget > 0:
+                    context_parts.append(self._truncate_tokens(part, token_budget))
+                    index += 1
+                dropped = len(documents) - index
+                if dropped:
+                    logger.warning(f"上下文超出token预算({token_budget})，丢弃 {dropped} 个排名靠后的文档")
+                break
+            context_parts.append(part)
+            used_tokens += tokens
+
+        return "\n\n".join(context_parts)
+
+    def _build_prompt(self, question: str, documents: List[Document]) -> str:
+        """构建答案生成提示词，上下文长度受模型上下文窗口限制"""
+        token_budget = (self.config.context_window - self.config.max_tokens
+                        - self._count_tokens(PROMPT_TMPL) - self._count_tokens(question))
+        context = self._build_context(documents, max(token_budget, 0))
+        return PROMPT_TMPL.format(context=context, question=question)
+
+    @staticmethod
+    def _cache_key(prompt: str) -> str:
+        """以提示词摘要作为答案缓存键"""
+        return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _get_cached_answer(self, key: str) -> Optional[str]:
+        """读取缓存的答案，未命中返回None"""
+        if self._answer_cache is None:
+            return None
+        with self._answer_cache_lock:
+            return self._answer_cache.get(key)
+
+    def _cache_answer(self, key: str, answer: str):
+        """缓存成功生成的答案"""
+        if self._answer_cache is None:
+            return
+        with self._answer_cache_lock:
+            self._answer_cache[key] = answer
+
+    def _async_client(self) -> AsyncOpenAI:
+        """获取当前事件循环对应的异步客户端"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            # 连接池与并发上限对齐，保持长连接复用，避免反复建立TLS连接
+            limits = httpx.Limits(max_connections=self.config.max_concurrency,
+                                  max_keepalive_connections=self.config.max_concurrency)
+            client = AsyncOpenAI(api_key=self.config.api_key,
+                                 base_url=self.config.api_base,
+                                 max_retries=0, # 重试由应用层退避策略统一控制
+                                 http_client=httpx.AsyncClient(limits=limits))
+            self._async_clients[loop] = client
+        return client
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        """获取当前事件循环对应的并发信号量，限制同时在途的请求数"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.config.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def _close_async_client(self):
+        """关闭当前事件循环对应的异步客户端"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def generate_adaptive_answer(self, question: str, documents: List[Document], max_retries: int = 3) -> str:
         """
         智能统一答案生成
         自动适应不同类型的查询，无需预先分类
         """
-        # 构建上下文
-        context_parts = []
-
-        for doc in documents:
-            content = doc.page_content.strip()
-            if content:
-                # 添加检索层级信息（如果有的话）
-                level = doc.metadata.get('retrieval_level', '')
-                if level:
-                    context_parts.append(f"[{level.upper()}] {content}")
-                else:
-                    context_parts.append(content)
+        prompt = self._build_prompt(question, documents)
+        cache_key = self._cache_key(prompt)
+        cached = self._get_cached_answer(cache_key)
+        if cached is not None:
+            logger.info("命中答案缓存")
+            return cached
+
+        max_retries = max(1, max_retries) # 至少请求一次
+        for attempt in range(max_retries):
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.config.model_name,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=self.config.temperature,
+                    max_tokens=self.config.max_tokens
+                )
 
-        context = "\n\n".join(context_parts)
+                answer = response.choices[0].message.content.strip()
+                self._cache_answer(cache_key, answer)
+                return answer
 
-        # LightRAG风格的统一提示词
-        prompt = f"""
-        作为一位专业的烹饪助手，请基于以下信息回答用户的问题。
+            except Exception as e:
+                if attempt < max_retries - 1 and _is_retryable(e):
+                    wait_time = _backoff_delay(attempt)
+                    logger.warning(f"答案生成第{attempt + 1}次尝试失败，{wait_time:.1f}秒后重试: {e}")
+                    time.sleep(wait_time)
+                    continue
+                logger.error(f"LightRAG答案生成失败: {e}")
+                return f"抱歉，生成回答时出现错误：{str(e)}"
 
-        检索到的相关信息：
-        {context}
+    async def agenerate_adaptive_answer(self, question: str, documents: List[Document], max_retries: int = 3) -> str:
+        """
+        异步生成答案，可与其他请求并发执行
+        """
+        prompt = self._build_prompt(question, documents)
+        cache_key = self._cache_key(prompt)
+        cached = self._get_cached_answer(cache_key)
+        if cached is not None:
+            return cached
 
-        用户问题：{question}
+        max_retries = max(1, max_retries) # 至少请求一次
+        for attempt in range(max_retries):
+            try:
+                async with self._semaphore():
+                    response = await self._async_client().chat.completions.create(
+                        model=self.config.model_name,
+                        messages=[
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=self.config.temperature,
+                        max_tokens=self.config.max_tokens
+                    )
+
+                answer = response.choices[0].message.content.strip()
+                self._cache_answer(cache_key, answer)
+                return answer
 
-        请提供准确、实用的回答。根据问题的性质：
-        - 如果是询问多个菜品，请提供清晰的列表
-        - 如果是询问具体制作方法，请提供详细步骤
-        - 如果是一般性咨询，请提供综合性回答
+            except Exception as e:
+                if attempt < max_retries - 1 and _is_retryable(e):
+                    # 退避等待时不占用并发名额
+                    wait_time = _backoff_delay(attempt)
+                    logger.warning(f"答案生成第{attempt + 1}次尝试失败，{wait_time:.1f}秒后重试: {e}")
+                    await asyncio.sleep(wait_time)
+                    continue
+                logger.error(f"LightRAG答案生成失败: {e}")
+                return f"抱歉，生成回答时出现错误：{str(e)}"
 
-        回答：
+    async def agenerate_adaptive_answer_stream(self, question: str, documents: List[Document]):
+        """
+        异步流式生成答案
         """
+        prompt = self._build_prompt(question, documents)
 
-        try:
-            response = self.client.chat.completions.create(
+        # 流式请求在整个接收过程中都占用一个并发名额
+        async with self._semaphore():
+            response = await self._async_client().chat.completions.create(
                 model=self.config.model_name,
                 messages=[
                     {"role": "user", "content": prompt}
                 ],
                 temperature=self.config.temperature,
-                max_tokens=self.config.max_tokens
+                max_tokens=self.config.max_tokens,
+                stream=True,
+                timeout=60
             )
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
 
-            return response.choices[0].message.content.strip()
-
-        except Exception as e:
-            logger.error(f"LightRAG答案生成失败: {e}")
-            return f"抱歉，生成回答时出现错误：{str(e)}"
-
-    def generate_adaptive_answer_stream(self, question: str, documents: List[Document], max_retries: int = 3):
-        """
-        LightRAG风格的流式答案生成（带重试机制）
+    async def generate_batch(self, items: List[Tuple[str, List[Document]]]) -> List[str]:
         """
-        # 构建上下文
-        context_parts = []
-
-        for doc in documents:
-            content = doc.page_content.strip()
-            if content:
-                level = doc.metadata.get('retrieval_level', '')
-                if level:
-                    context_parts.append(f"[{level.upper()}] {content}")
-                else:
-                    context_parts.append(content)
-
-        context = "\n\n".join(context_parts)
+        并发生成多个问题的答案
 
-        # LightRAG风格的统一提示词
-        prompt = f"""
-        作为一位专业的烹饪助手，请基于以下信息回答用户的问题。
+        Args:
+            items: (问题, 检索文档)列表
 
-        检索到的相关信息：
-        {context}
+        Returns:
+            与输入顺序一致的答案列表
+        """
+        return await asyncio.gather(*[self.agenerate_adaptive_answer(question, documents)
+                                      for question, documents in items])
 
-        用户问题：{question}
+    def generate_batch_sync(self, items: List[Tuple[str, List[Document]]]) -> List[str]:
+        """generate_batch的同步入口，供非异步代码调用"""
+        async def _run():
+            try:
+                return await self.generate_batch(items)
+            finally:
+                await self._close_async_client()
 
-        请提供准确、实用的回答。根据问题的性质：
-        - 如果是询问多个菜品，请提供清晰的列表
-        - 如果是询问具体制作方法，请提供详细步骤
-        - 如果是一般性咨询，请提供综合性回答
+        return asyncio.run(_run())
 
-        回答：
+    def generate_adaptive_answer_stream(self, question: str, documents: List[Document], max_retries: int = 3):
         """
-
+        LightRAG风格的流式答案生成（带重试机制）
+        """
+        prompt = self._build_prompt(question, documents)
+        # 流式结果不写入缓存，但已缓存的答案可直接整段返回
+        cached = self._get_cached_answer(self._cache_key(prompt))
+        if cached is not None:
+            yield cached
+            return
+
+        max_retries = max(1, max_retries) # 至少请求一次
+        yielded = False # 是否已向调用方输出过内容
         for attempt in range(max_retries):
             try:
                 response = self.client.chat.completions.create(
@@ -129,12 +345,11 @@ class LLMModule:
                 else:
                     print(f"第{attempt + 1}次尝试流式生成...\n")
 
-                full_response = ""
+                # 逐块直接返回，不在内存中累积完整回答
                 for chunk in response:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        full_response += content
-                        yield content  # 使用yield返回流式内容
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yielded = True
+                        yield chunk.choices[0].delta.content
 
                 # 如果成功完成，退出重试循环
                 return
@@ -142,9 +357,15 @@ class LLMModule:
             except Exception as e:
                 logger.warning(f"流式生成第{attempt + 1}次尝试失败: {e}")
 
-                if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 2  # 递增等待时间
-                    print(f"⚠️ 连接中断，{wait_time}秒后重试...")
+                # 已输出部分内容时不再重试或后备，否则调用方会收到重复的内容
+                if yielded:
+                    logger.error("流式生成在输出过程中中断")
+                    raise
+
+                # 仅对限流、超时、连接中断等临时错误重试
+                if attempt < max_retries - 1 and _is_retryable(e):
+                    wait_time = _backoff_delay(attempt)
+                    print(f"⚠️ 连接中断，{wait_time:.1f}秒后重试...")
                     time.sleep(wait_time)
                     continue
                 else:
@@ -153,7 +374,8 @@ class LLMModule:
                     print("⚠️ 流式生成失败，切换到标准模式...")
 
                     try:
-                        fallback_response = self.generate_adaptive_answer(question, documents)
+                        # 流式重试已用完，后备只请求一次，避免重试次数叠加
+                        fallback_response = self.generate_adaptive_answer(question, documents, max_retries=1)
                         yield fallback_response
                         return
                     except Exception as fallback_error:
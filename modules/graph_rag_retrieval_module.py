@@ -1,13 +1,45 @@
 import json
 import logging
+import threading
 from dataclasses import dataclass
 from enum import Enum
 from typing import List, Dict, Any, Optional
 
+from cachetools import LRUCache, TTLCache
 from langchain_core.documents import Document
-from neo4j import GraphDatabase
+from neo4j import READ_ACCESS
+from neo4j.exceptions import ClientError
+
+from .graph_data_module import GraphDataModule
+
 logger = logging.getLogger(__name__)
 
+# 缓存容量与有效期
+ENTITY_CACHE_SIZE = 10_000
+SUBGRAPH_CACHE_SIZE = 1_000
+SUBGRAPH_CACHE_TTL = 60  # 秒
+
+# 度数最高的实体；COUNT{}子查询直接读取节点的关系计数，无需展开邻居
+# 缓存条目在Cypher中直接投影为map，客户端无需逐条组装
+ENTITY_INDEX_QUERY = """
+MATCH (n)
+WHERE n.nodeId IS NOT NULL
+WITH n, COUNT { (n)--() } as degree
+ORDER BY degree DESC
+LIMIT 1000
+RETURN n.nodeId as node_id,
+       {labels: labels(n), name: n.name, category: n.category, degree: degree} as entity
+"""
+
+# 关系类型计数：优先读取APOC统计（来自计数存储，不扫描关系）
+RELATION_STATS_APOC_QUERY = "CALL apoc.meta.stats() YIELD relTypesCount RETURN relTypesCount"
+
+# 无APOC时的后备方案：扫描全部关系
+RELATION_STATS_QUERY = """
+MATCH ()-[r]->()
+RETURN type(r) as rel_type, count(r) as frequency
+"""
+
 
 class QueryType(Enum):
     """查询类型枚举"""
@@ -62,24 +94,19 @@ class GraphRAGRetrievalModule:
         self.driver = None
 
 
-        # 图结构缓存
-        self.entity_cache = {} # 实体缓存
-        self.relation_cache = {} # 关系缓存
-        self.subgraph_cache = {} # 子图缓存
+        # 图结构缓存：容量有上限，子图缓存带有效期，避免长时间运行后无限增长或返回过期结果
+        self.entity_cache = LRUCache(maxsize=ENTITY_CACHE_SIZE) # 实体缓存
+        self.relation_cache = {} # 关系缓存（关系类型数量有限）
+        self.subgraph_cache = TTLCache(maxsize=SUBGRAPH_CACHE_SIZE, ttl=SUBGRAPH_CACHE_TTL) # 子图缓存
+        self._cache_lock = threading.Lock()
 
     def initialize(self):
         """初始化图RAG检索系统"""
         logger.info("初始化图RAG检索系统...")
 
-        # 连接Neo4j
+        # 连接Neo4j：与其他模块共用同一个驱动及连接池，连通性在驱动创建时已校验
         try:
-            self.driver = GraphDatabase.driver(
-                self.config.neo4j_config.uri,
-                auth=(self.config.neo4j_config.user, self.config.neo4j_config.password)
-            )
-            # 测试连接
-            with self.driver.session() as session:
-                session.run("RETURN 1")
+            self.driver = GraphDataModule.get_driver(self.config.neo4j_config)
             logger.info("Neo4j连接成功")
         except Exception as e:
             logger.error(f"Neo4j连接失败: {e}")
@@ -92,45 +119,36 @@ class GraphRAGRetrievalModule:
         """构建图索引以加速查询"""
         logger.info("构建图结构索引...")
         try:
-            with self.driver.session() as session:
-                # 构建实体索引 - 修复Neo4j语法兼容性问题
-                entity_query = """
-                MATCH (n)
-                WHERE n.nodeId IS NOT NULL
-                WITH n, COUNT { (n)--() } as degree
-                RETURN labels(n) as node_labels, n.nodeId as node_id, 
-                       n.name as name, n.category as category, degree
-                ORDER BY degree DESC
-                LIMIT 1000
-                """
+            # 两个查询共用一个只读会话
+            with self.driver.session(default_access_mode=READ_ACCESS) as session:
+                try:
+                    entities, relations = session.execute_read(self._read_graph_index, True)
+                except ClientError as e:
+                    logger.debug(f"APOC统计不可用，改为扫描关系: {e}")
+                    entities, relations = session.execute_read(self._read_graph_index, False)
 
-                result = session.run(entity_query)
-                for record in result:
-                    node_id = record["node_id"]
-                    self.entity_cache[node_id] = {
-                        "labels": record["node_labels"],
-                        "name": record["name"],
-                        "category": record["category"],
-                        "degree": record["degree"]
-                    }
+            self.entity_cache.update(entities)
 
-                # 构建关系类型索引
-                relation_query = """
-                MATCH ()-[r]->()
-                RETURN type(r) as rel_type, count(r) as frequency
-                ORDER BY frequency DESC
-                """
+            # 按出现频次降序写入关系类型索引
+            for rel_type, frequency in sorted(relations.items(), key=lambda item: item[1], reverse=True):
+                self.relation_cache[rel_type] = frequency
 
-                result = session.run(relation_query)
-                for record in result:
-                    rel_type = record["rel_type"]
-                    self.relation_cache[rel_type] = record["frequency"]
-
-                logger.info(f"索引构建完成: {len(self.entity_cache)}个实体, {len(self.relation_cache)}个关系类型")
+            logger.info(f"索引构建完成: {len(self.entity_cache)}个实体, {len(self.relation_cache)}个关系类型")
 
         except Exception as e:
             logger.error(f"构建图索引失败: {e}")
 
+    @staticmethod
+    def _read_graph_index(tx, use_apoc: bool):
+        """在同一读事务中查询高连接度实体和关系类型频次"""
+        entities = dict(tx.run(ENTITY_INDEX_QUERY).values())
+        if use_apoc:
+            record = tx.run(RELATION_STATS_APOC_QUERY).single()
+            relations = dict(record["relTypesCount"]) if record else {}
+        else:
+            relations = dict(tx.run(RELATION_STATS_QUERY).values())
+        return entities, relations
+
     def extract_knowledge_subgraph(self, graph_query: GraphQuery) -> KnowledgeSubgraph:
         """
         提取知识子图：获取实体相关的完整知识网络
@@ -142,6 +160,13 @@ class GraphRAGRetrievalModule:
             logger.error("Neo4j连接未建立")
             return self._fallback_subgraph_extraction(graph_query)
 
+        cache_key = (tuple(graph_query.source_entities), graph_query.max_depth, graph_query.max_nodes)
+        with self._cache_lock:
+            cached = self.subgraph_cache.get(cache_key)
+        if cached is not None:
+            logger.info("命中子图缓存")
+            return cached
+
         try:
             with self.driver.session() as session:
                 # 简化的子图提取（不依赖APOC）
@@ -181,7 +206,12 @@ class GraphRAGRetrievalModule:
 
                 record = result.single()
                 if record:
-                    return self._build_knowledge_subgraph(record)
+                    subgraph = self._build_knowledge_subgraph(record)
+                    # 只缓存成功提取的子图，降级结果不缓存
+                    if subgraph.central_nodes:
+                        with self._cache_lock:
+                            self.subgraph_cache[cache_key] = subgraph
+                    return subgraph
 
         except Exception as e:
             logger.error(f"子图提取失败: {e}")
@@ -189,6 +219,24 @@ class GraphRAGRetrievalModule:
         # 降级方案：简单邻居查询
         return self._fallback_subgraph_extraction(graph_query)
 
+    def invalidate_node(self, node_id: str):
+        """
+        节点被修改后使相关缓存失效
+
+        Args:
+            node_id: 被修改节点的nodeId
+        """
+        with self._cache_lock:
+            self.entity_cache.pop(node_id, None)
+            stale_keys = [
+                key for key, subgraph in self.subgraph_cache.items()
+                if any(node.get("nodeId") == node_id
+                       for node in subgraph.central_nodes + subgraph.connected_nodes)
+            ]
+            for key in stale_keys:
+                self.subgraph_cache.pop(key, None)
+        logger.debug(f"已失效节点 {node_id} 的缓存，清除子图 {len(stale_keys)} 个")
+
     def graph_structure_reasoning(self, subgraph: KnowledgeSubgraph, query: str) -> List[str]:
         """
         基于图结构的推理：这是图RAG的智能之处
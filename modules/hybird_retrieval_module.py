@@ -1,18 +1,61 @@
+import hashlib
 import json
 import logging
+import os
+import pickle
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from functools import cached_property
+from typing import List, Dict, Any, Optional, Tuple
 
 from langchain_community.retrievers import BM25Retriever
 from langchain_core.documents import Document
-from neo4j import GraphDatabase
-from sqlalchemy.orm import relationship
+from neo4j import READ_ACCESS
 
-from modules import GraphIndexingModule
+from .graph_data_module import GraphDataModule
+from .graph_index_module import GraphIndexingModule
 
 logger = logging.getLogger(__name__)
 
+# 业务数据节点的nodeId下限（nodeId为字符串，按字典序比较）
+MIN_NODE_ID = '200000000'
+
+# 起点或终点为业务节点的关系：nodeId >= $min_node_id 的节点只有Recipe/Ingredient/CookingStep三类，
+# 每个UNION分支带上一个标签，使范围谓词能走该标签nodeId唯一约束的索引；
+# 阈值和条数都作为参数传入，查询文本不变，执行计划可复用
+RELATIONSHIPS_QUERY = """
+CALL {
+    MATCH (source:Recipe)-[r]->(target)
+    WHERE source.nodeId >= $min_node_id
+    RETURN source.nodeId as source_id, type(r) as relation_type, target.nodeId as target_id
+    UNION
+    MATCH (source)-[r]->(target:Recipe)
+    WHERE target.nodeId >= $min_node_id
+    RETURN source.nodeId as source_id, type(r) as relation_type, target.nodeId as target_id
+    UNION
+    MATCH (source:Ingredient)-[r]->(target)
+    WHERE source.nodeId >= $min_node_id
+    RETURN source.nodeId as source_id, type(r) as relation_type, target.nodeId as target_id
+    UNION
+    MATCH (source)-[r]->(target:Ingredient)
+    WHERE target.nodeId >= $min_node_id
+    RETURN source.nodeId as source_id, type(r) as relation_type, target.nodeId as target_id
+    UNION
+    MATCH (source:CookingStep)-[r]->(target)
+    WHERE source.nodeId >= $min_node_id
+    RETURN source.nodeId as source_id, type(r) as relation_type, target.nodeId as target_id
+    UNION
+    MATCH (source)-[r]->(target:CookingStep)
+    WHERE target.nodeId >= $min_node_id
+    RETURN source.nodeId as source_id, type(r) as relation_type, target.nodeId as target_id
+}
+RETURN source_id, relation_type, target_id
+LIMIT $limit
+"""
+# 提取的关系条数上限
+RELATIONSHIPS_LIMIT = 1000
+
 
 @dataclass
 class RetrievalResult:
@@ -43,29 +86,58 @@ class HybridRetrievalModule:
         self.llm_client = llm_client
 
         self.driver = None
-        self.bm25_retriever = None # BM25检索
-
+        self._bm25_future: Optional[Future] = None # BM25检索器在后台线程构建
 
-        self.graph_indexing = GraphIndexingModule(config,llm_client)
         self.graph_indexed = False
 
+    @cached_property
+    def graph_indexing(self) -> GraphIndexingModule:
+        """图索引模块，首次使用时才创建"""
+        return GraphIndexingModule(self.config, self.llm_client)
+
     def initialize(self, chunks:List[Document]):
         """初始化"""
         logger.info("初始化混合检索模块...")
 
-        # 连接neo4j
-        self.driver = GraphDatabase.driver(
-            self.config.neo4j_config.uri,
-            auth=(self.config.neo4j_config.user, self.config.neo4j_config.password)
-        )
+        # 连接neo4j：与其他模块共用同一个驱动及连接池
+        self.driver = GraphDataModule.get_driver(self.config.neo4j_config)
 
-        # 创建BM25检索
+        # 在后台线程创建BM25检索，与图索引构建并行进行
         if chunks:
-            self.bm25_retriever = BM25Retriever.from_documents(chunks)
-            logger.info(f"BM25检索器初始化完成，文档数量: {len(chunks)}")
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25")
+            self._bm25_future = executor.submit(self._build_bm25_retriever, chunks)
+            # 构建失败时立即记录日志，不依赖后续是否访问bm25_retriever
+            self._bm25_future.add_done_callback(self._log_bm25_failure)
+            executor.shutdown(wait=False)
 
         self._build_graph_index()
 
+    @staticmethod
+    def _build_bm25_retriever(chunks: List[Document]) -> BM25Retriever:
+        """构建BM25检索器"""
+        retriever = BM25Retriever.from_documents(chunks)
+        logger.info(f"BM25检索器初始化完成，文档数量: {len(chunks)}")
+        return retriever
+
+    @staticmethod
+    def _log_bm25_failure(future: Future):
+        """后台构建BM25检索器完成时的回调，记录构建异常"""
+        error = future.exception()
+        if error is not None:
+            logger.error(f"BM25检索器初始化失败: {error}")
+
+    @property
+    def bm25_retriever(self) -> Optional[BM25Retriever]:
+        """BM25检索器，首次访问时等待后台构建完成"""
+        if self._bm25_future is None:
+            return None
+        try:
+            return self._bm25_future.result()
+        except Exception:
+            # 异常已在完成回调中记录
+            self._bm25_future = None
+            return None
+
     def _build_graph_index(self):
         """构建图索引"""
 
@@ -93,24 +165,68 @@ class HybridRetrievalModule:
             logger.error(f"构建图索引失败: {e}")
 
     def _extract_relationships_from_graph(self):
-        """从Neo4j图中提取关系"""
+        """从Neo4j图中提取关系，图数据未变化时直接读取本地缓存"""
+        try:
+            # 查询文本和参数也计入缓存键，查询逻辑变化后旧缓存自动失效
+            query_digest = hashlib.blake2b(
+                f"{RELATIONSHIPS_QUERY}|{MIN_NODE_ID}|{RELATIONSHIPS_LIMIT}".encode("utf-8"), digest_size=16
+            ).hexdigest()
+            cache_key = (self.config.neo4j_config.uri, self.config.neo4j_config.database,
+                         self.data_module.get_graph_version(), query_digest)
+        except Exception as e:
+            logger.warning(f"获取图数据版本失败，不使用关系缓存: {e}")
+            cache_key = None
+
+        cache_path = os.path.join(self.config.cache_dir, "graph_relationships.pkl")
+        if cache_key is not None:
+            relationships = self._load_relationships_cache(cache_path, cache_key)
+            if relationships is not None:
+                return relationships
+
+        relationships = self._query_relationships(RELATIONSHIPS_LIMIT)
+        if cache_key is not None and relationships:
+            self._save_relationships_cache(cache_path, cache_key, relationships)
+        return relationships
+
+    @staticmethod
+    def _load_relationships_cache(path: str, cache_key: Tuple) -> Optional[List[Tuple[str, str, str]]]:
+        """读取关系缓存，缓存不存在或图版本不一致时返回None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                cached_key, relationships = pickle.load(f)
+            if cached_key != cache_key:
+                logger.info("图关系缓存已过期")
+                return None
+            logger.info(f"已加载图关系缓存: {path}，共 {len(relationships)} 条关系")
+            return relationships
+        except Exception as e:
+            logger.warning(f"加载图关系缓存失败: {e}")
+            return None
+
+    @staticmethod
+    def _save_relationships_cache(path: str, cache_key: Tuple, relationships: List[Tuple[str, str, str]]):
+        """保存关系缓存，先写临时文件再替换"""
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((cache_key, relationships), f, protocol=5)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"保存图关系缓存失败: {e}")
+
+    def _query_relationships(self, limit: int = RELATIONSHIPS_LIMIT) -> List[Tuple[str, str, str]]:
+        """查询Neo4j中的关系"""
         relationships = []
 
         try :
-            with self.config.neo4j_config.driver.session() as session:
-                query = """
-                                MATCH (source)-[r]->(target)
-                                WHERE source.nodeId >= '200000000' OR target.nodeId >= '200000000'
-                                RETURN source.nodeId as source_id, type(r) as relation_type, target.nodeId as target_id
-                                LIMIT 1000
-                                """
-                result = session.run(query)
-                for record in result:
-                    relationships.append((
-                        record["source_id"],
-                        record["relation_type"],
-                        record["target_id"]
-                    ))
+            with self.driver.session(default_access_mode=READ_ACCESS) as session:
+                relationships = session.execute_read(
+                    lambda tx: [tuple(values) for values in
+                                tx.run(RELATIONSHIPS_QUERY, min_node_id=MIN_NODE_ID, limit=limit).values()]
+                )
 
         except Exception as e:
             logger.error(f"提取图关系失败: {e}")
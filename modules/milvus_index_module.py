@@ -1,30 +1,47 @@
 import logging
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 
+import torch
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
 from pymilvus import MilvusClient, CollectionSchema, FieldSchema, DataType
+from sentence_transformers import SentenceTransformer
+from tqdm import tqdm
 
 from config import MilvusConfig
 
+try:
+    from pymilvus.bulk_writer import RemoteBulkWriter, BulkFileType, bulk_import, get_import_progress
+except ImportError: # 未安装pymilvus[bulk_writer]依赖时只使用分批insert
+    RemoteBulkWriter = None
+
 logger = logging.getLogger(__name__)
 
 
-def _safe_truncate(text: str, max_length: int):
-    """
-    安全截取字符串，处理None值
+# 直接取自chunk元数据的VARCHAR字段及其最大长度，与集合模式保持一致
+METADATA_VARCHAR_FIELDS = (
+    ("node_id", 100),
+    ("recipe_name", 300),
+    ("node_type", 100),
+    ("category", 100),
+    ("cuisine_type", 200),
+    ("doc_type", 50),
+    ("parent_id", 100),
+)
+# 构建索引时每批向量化的文本数，向量化与插入以该粒度流水线执行，每批一次insert请求；
+# 按字段长度上限估算，每批最大约12MB，低于gRPC默认64MB的消息上限
+PIPELINE_BATCH_SIZE = 256
+# 向量编码批大小，encode内部会按文本长度排序分批，减少padding
+EMBEDDING_BATCH_SIZE = 64
+# 轮询批量导入任务进度的间隔（秒）
+BULK_IMPORT_POLL_INTERVAL = 2
 
-    Args:
-        text: 输入文本
-        max_length: 最大长度
 
-    Returns:
-        截取后的字符串
-    """
-    if text is None:
-        return ""
-    return str(text)[:max_length]
+_embedding_models: Dict[str, SentenceTransformer] = {} # 进程内共享的嵌入模型，按模型名缓存
+_embedding_models_lock = threading.Lock()
 
 
 class MilvusIndexModule:
@@ -36,9 +53,13 @@ class MilvusIndexModule:
 
         self.client = None
 
-        self.embeddings =  None
+        self.embedding_model: Optional[SentenceTransformer] = None
         self.collection_created = False
 
+        # 集合状态缓存，避免重复的Milvus RPC；仅在写操作（建/删集合、构建索引）时失效
+        self._has_collection: Optional[bool] = None
+        self._loaded: bool = False
+
         self._init_milvus()
         self._init_embeddings()
 
@@ -54,15 +75,54 @@ class MilvusIndexModule:
             logger.error(f"连接Milvus失败: {e}")
             raise
 
+    @classmethod
+    def get_embedding_model(cls, model_name: str) -> SentenceTransformer:
+        """
+        获取嵌入模型（进程内按模型名共享）
+
+        同一模型只加载一次，多个实例共用同一份权重。CPU上权重放入共享内存，
+        多worker部署时可在主进程预先调用本方法（如gunicorn --preload），
+        fork出的worker直接复用已加载的模型，不再各自加载一份
+        """
+        with _embedding_models_lock:
+            model = _embedding_models.get(model_name)
+            if model is not None:
+                return model
+
+            logger.info(f"正在初始化嵌入模型: {model_name}")
+
+            # 直接使用SentenceTransformer，省去LangChain包装层逐批转换为list的开销
+            # 有GPU时使用GPU并以fp16加载权重，显存/带宽减半；CPU保持fp32
+            if torch.cuda.is_available():
+                device, model_kwargs = "cuda", {"torch_dtype": torch.float16}
+            else:
+                device, model_kwargs = "cpu", None
+
+            model = SentenceTransformer(model_name, device=device, model_kwargs=model_kwargs)
+            model.eval()
+            if device == "cpu":
+                # 权重移入共享内存，fork后各worker共享同一份物理页
+                for parameter in model.parameters():
+                    parameter.share_memory_()
+
+            logger.info(f"嵌入模型初始化完成，设备: {device}")
+            _embedding_models[model_name] = model
+            return model
+
     def _init_embeddings(self):
         """初始化向量模型"""
-        logger.info(f"正在初始化嵌入模型: {self.embedding_model_name}")
-        self.embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model_name,
-                                                model_kwargs={"device": "cpu"}, # 使用CPU
-                                                encode_kwargs={"normalize_embeddings": False} # 不进行归一化
-                                                )
-
-        logger.info(f"嵌入模型初始化完成")
+        self.embedding_model = self.get_embedding_model(self.embedding_model_name)
+
+    def _encode(self, texts: List[str], show_progress_bar: bool = False) -> List[List[float]]:
+        """批量编码文本为向量（不进行归一化）"""
+        with torch.inference_mode():
+            vectors = self.embedding_model.encode(texts,
+                                                  batch_size=EMBEDDING_BATCH_SIZE,
+                                                  normalize_embeddings=False,
+                                                  convert_to_numpy=True,
+                                                  show_progress_bar=show_progress_bar)
+        # fp16模型输出统一转为float32后交给Milvus
+        return vectors.astype("float32", copy=False).tolist()
 
     def has_collection(self) -> bool:
         """
@@ -71,8 +131,12 @@ class MilvusIndexModule:
         Returns:
             集合是否存在
         """
+        if self._has_collection is not None:
+            return self._has_collection
+
         try:
-            return self.client.has_collection(self.config.collection_name)
+            self._has_collection = self.client.has_collection(self.config.collection_name)
+            return self._has_collection
         except Exception as e:
             logger.error(f"检查集合存在性失败: {e}")
             return False
@@ -84,13 +148,17 @@ class MilvusIndexModule:
         Returns:
             是否加载成功
         """
+        if self._loaded:
+            return True
+
         try:
-            if not self.client.has_collection(self.config.collection_name):
+            if not self.has_collection():
                 logger.error(f"集合 {self.config.collection_name} 不存在")
                 return False
 
             self.client.load_collection(self.config.collection_name)
             self.collection_created = True
+            self._loaded = True
             logger.info(f"集合 {self.config.collection_name} 已加载到内存")
             return True
 
@@ -98,74 +166,199 @@ class MilvusIndexModule:
             logger.error(f"加载集合失败: {e}")
             return False
 
+    def ensure_loaded(self) -> bool:
+        """
+        确保集合存在并已加载，结果会被缓存
+
+        Returns:
+            集合是否可用
+        """
+        return self.has_collection() and self.load_collection()
+
+    def delete_collection(self) -> bool:
+        """
+        删除集合
+
+        Returns:
+            是否删除成功
+        """
+        try:
+            if self.client.has_collection(self.config.collection_name):
+                self.client.drop_collection(self.config.collection_name)
+            self._invalidate_collection_state()
+            self.collection_created = False
+            logger.info(f"集合 {self.config.collection_name} 已删除")
+            return True
+        except Exception as e:
+            logger.error(f"删除集合失败: {e}")
+            return False
+
+    def _invalidate_collection_state(self):
+        """写操作后重置集合状态缓存"""
+        self._has_collection = None
+        self._loaded = False
+
     def build_vector_index(self, chunks: List[Document]) -> bool:
         """构建向量索引"""
         logger.info(f"正在构建Milvus向量索引，文档数量: {len(chunks)}...")
 
         if not chunks:
             raise ValueError("文档列表为空")
+        self._invalidate_collection_state()
         # 1.创建集合
         if not self.create_collection(force_recreate=True):
             return False
-        # 2.准备数据
-        logger.info("正在生成向量embeddings...")
-        texts = [chunk.page_content for chunk in chunks]
-        vectors = self.embeddings.embed_documents( texts)
-
-        # 3.向集合中插入数据
-        entities = []
-        for i ,(chunk, vector) in enumerate(zip(chunks, vectors)):
-            entity = {
-                "id": _safe_truncate(chunk.metadata.get("chunk_id", f"chunk_{i}"), 150),
-                "vector": vector,
-                "text": _safe_truncate(chunk.page_content, 15000),
-                "node_id": _safe_truncate(chunk.metadata.get("node_id", ""), 100),
-                "recipe_name": _safe_truncate(chunk.metadata.get("recipe_name", ""), 300),
-                "node_type": _safe_truncate(chunk.metadata.get("node_type", ""), 100),
-                "category": _safe_truncate(chunk.metadata.get("category", ""), 100),
-                "cuisine_type": _safe_truncate(chunk.metadata.get("cuisine_type", ""), 200),
-                "difficulty": int(chunk.metadata.get("difficulty", 0)),
-                "doc_type": _safe_truncate(chunk.metadata.get("doc_type", ""), 50),
-                "chunk_id": _safe_truncate(chunk.metadata.get("chunk_id", f"chunk_{i}"), 150),
-                "parent_id": _safe_truncate(chunk.metadata.get("parent_id", ""), 100)
-            }
-            entities.append(entity)
-
-        # 4.批量插入数据
-        batch_size = 100
-        for i in range(0, len(entities), batch_size):
-            batch = entities[i:i+batch_size]
-            self.client.insert(
-                collection_name=self.config.collection_name,
-                data=batch,
-                timeout=60
-            )
-            logger.info(f"已插入 {min(i + batch_size, len(entities))}/{len(entities)} 条数据")
-
-        # 5.创建索引
+        # 2.大语料走MinIO批量导入，失败或小语料时走分批insert流水线
+        total = len(chunks)
+        imported = False
+        if self._use_bulk_import(total):
+            imported = self._bulk_import(chunks)
+            if not imported:
+                logger.warning("批量导入失败，回退到分批insert")
+                # 重建集合，丢弃导入任务可能写入的部分数据
+                if not self.create_collection(force_recreate=True):
+                    return False
+        if not imported:
+            self._insert_pipeline(chunks)
+        logger.info(f"已插入 {total} 条数据")
+
+        # 3.数据全部落盘后一次性建索引，避免对增长中的segment反复增量建图
+        self.client.flush(self.config.collection_name)
         if not self.create_index():
             return  False
 
-        #6. 加载索引到内存
+        #4. 加载索引到内存
         self.client.load_collection(self.config.collection_name)
+        self._loaded = True
         logger.info("集合已加载到内存")
 
-        # 7. 等待索引构建完成
+        # 5. 等待索引构建完成
         logger.info("等待索引构建完成...")
         time.sleep(2)
 
         logger.info(f"向量索引构建完成，包含 {len(chunks)} 个向量")
         return True
 
+    def _insert_pipeline(self, chunks: List[Document]):
+        """流水线生成向量并插入：主线程编码第N+1批时，后台线程插入第N批"""
+        logger.info("正在生成向量embeddings并插入数据...")
+        total = len(chunks)
+        pending = None
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for start in tqdm(range(0, total, PIPELINE_BATCH_SIZE), desc="向量化并插入", unit="batch",
+                              disable=not sys.stderr.isatty()):
+                batch = chunks[start:start + PIPELINE_BATCH_SIZE]
+                vectors = self._encode([chunk.page_content for chunk in batch])
+                rows = self._build_rows(batch, vectors, start)
+                # 等待上一批插入完成，保证同一时刻最多只有一批在插入
+                if pending is not None:
+                    pending.result()
+                pending = executor.submit(self._insert_rows, rows)
+            if pending is not None:
+                pending.result()
+
+    def _use_bulk_import(self, total: int) -> bool:
+        """分块数达到阈值且bulk_writer可用时走批量导入"""
+        threshold = self.config.bulk_insert_threshold
+        if threshold <= 0 or total < threshold:
+            return False
+        if RemoteBulkWriter is None:
+            logger.info("未安装pymilvus[bulk_writer]依赖，使用分批insert")
+            return False
+        return True
+
+    def _bulk_import(self, chunks: List[Document]) -> bool:
+        """向量化后写成Parquet文件上传到MinIO，再提交bulk_import任务并等待完成"""
+        logger.info("正在生成向量embeddings并写入批量导入文件...")
+        total = len(chunks)
+        try:
+            connect_param = RemoteBulkWriter.S3ConnectParam(
+                endpoint=self.config.minio_endpoint,
+                access_key=self.config.minio_access_key,
+                secret_key=self.config.minio_secret_key,
+                bucket_name=self.config.minio_bucket,
+                secure=self.config.minio_secure,
+            )
+            with RemoteBulkWriter(schema=self._create_collection_schema(),
+                                  remote_path=f"bulk_insert/{self.config.collection_name}",
+                                  connect_param=connect_param,
+                                  file_type=BulkFileType.PARQUET) as writer:
+                for start in tqdm(range(0, total, PIPELINE_BATCH_SIZE), desc="向量化并写入文件", unit="batch",
+                                  disable=not sys.stderr.isatty()):
+                    batch = chunks[start:start + PIPELINE_BATCH_SIZE]
+                    vectors = self._encode([chunk.page_content for chunk in batch])
+                    for row in self._build_rows(batch, vectors, start):
+                        writer.append_row(row)
+                writer.commit()
+                batch_files = writer.batch_files
+
+            url = f"http://{self.config.host}:{self.config.port}"
+            resp = bulk_import(url=url, collection_name=self.config.collection_name, files=batch_files).json()
+            if resp.get("code") != 0:
+                logger.error(f"提交批量导入任务失败: {resp.get('message')}")
+                return False
+            job_id = resp["data"]["jobId"]
+            logger.info(f"已提交批量导入任务 {job_id}，文件数: {len(batch_files)}")
+            return self._wait_import_job(url, job_id)
+        except Exception as e:
+            logger.error(f"批量导入失败: {e}")
+            return False
+
+    def _wait_import_job(self, url: str, job_id: str) -> bool:
+        """轮询导入任务进度，直到完成、失败或超时"""
+        deadline = time.monotonic() + self.config.bulk_import_timeout
+        while time.monotonic() < deadline:
+            resp = get_import_progress(url=url, job_id=job_id).json()
+            data = resp.get("data") or {}
+            state = data.get("state")
+            if state == "Completed":
+                logger.info(f"批量导入任务 {job_id} 完成，导入 {data.get('importedRows')} 行")
+                return True
+            if state == "Failed" or resp.get("code") != 0:
+                logger.error(f"批量导入任务 {job_id} 失败: {data.get('reason') or resp.get('message')}")
+                return False
+            time.sleep(BULK_IMPORT_POLL_INTERVAL)
+        logger.error(f"批量导入任务 {job_id} 超时（{self.config.bulk_import_timeout}秒）")
+        return False
+
+    @staticmethod
+    def _build_rows(chunks: List[Document], vectors: List[List[float]], offset: int) -> List[Dict[str, Any]]:
+        """单次遍历直接构建一批行数据（MilvusClient.insert只接受行字典），截断长度与集合模式一致"""
+        rows = []
+        for i, (chunk, vector) in enumerate(zip(chunks, vectors), start=offset):
+            metadata = chunk.metadata
+            chunk_id = str(metadata.get("chunk_id") or f"chunk_{i}")[:150]
+            row = {
+                "id": chunk_id,
+                "vector": vector,
+                "text": (chunk.page_content or "")[:15000],
+                "difficulty": int(metadata.get("difficulty") or 0),
+                "chunk_id": chunk_id,
+            }
+            for name, max_length in METADATA_VARCHAR_FIELDS:
+                row[name] = str(metadata.get(name) or "")[:max_length]
+            rows.append(row)
+        return rows
+
+    def _insert_rows(self, rows: List[Dict[str, Any]]):
+        """一次请求插入一批行数据"""
+        self.client.insert(
+            collection_name=self.config.collection_name,
+            data=rows,
+            timeout=60
+        )
+
     def create_collection(self, force_recreate: bool = False):
         """创建Milvus集合 force_recreate: 是否强制重新创建集合"""
         try:
             if self.client.has_collection(self.config.collection_name):
                 if force_recreate:
                     self.client.drop_collection(self.config.collection_name)
+                    self._invalidate_collection_state()
                 else:
                     logger.info(f"集合 {self.config.collection_name} 已经存在")
                     self.collection_created = True
+                    self._has_collection = True
                     return True
             # 创建集合
             schema = self._create_collection_schema()
@@ -177,6 +370,7 @@ class MilvusIndexModule:
                                           )
             logger.info(f"创建集合 {self.config.collection_name} 成功")
             self.collection_created = True
+            self._has_collection = True
             return True
         except Exception as e:
             logger.error(f"创建Milvus集合失败: {e}")
@@ -231,17 +425,24 @@ class MilvusIndexModule:
             if not self.collection_created:
                 raise ValueError("请先创建集合")
 
+            # 重建时先删除旧索引，避免沿用残缺的旧图
+            if "vector" in self.client.list_indexes(self.config.collection_name, field_name="vector"):
+                self.client.release_collection(self.config.collection_name)
+                self._loaded = False
+                self.client.drop_index(self.config.collection_name, index_name="vector")
+
             # 使用prepare_index_params创建正确的IndexParams对象
             index_params = self.client.prepare_index_params()
 
             # 添加向量字段
             index_params.add_index(
                 field_name="vector",
+                index_name="vector",
                 index_type="HNSW",
                 metric_type="COSINE",
                 params={
-                    "M": 16,
-                    "efConstruction": 200
+                    "M": self.config.hnsw_m,
+                    "efConstruction": self.config.hnsw_ef_construction
                 }
             )
             self.client.create_index(
@@ -249,7 +450,7 @@ class MilvusIndexModule:
                 index_params=index_params
             )
 
-            logger.info("向量索引创建成功")
+            logger.info(f"向量索引创建成功 (M={self.config.hnsw_m}, efConstruction={self.config.hnsw_ef_construction})")
             return True
 
         except Exception as e:
@@ -297,7 +498,7 @@ class MilvusIndexModule:
 
         try:
             # 生成查询向量
-            query_vector = self.embeddings.embed_query(query)
+            query_vector = self._encode([query])[0]
 
             # 构建过滤表达式
             filter_expr = ""
@@ -1,20 +1,42 @@
 import json
 import logging
 import re
+import threading
 from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Optional
 
 from langchain_core.documents import Document
 
 logger = logging.getLogger(__name__)
 
+# 规则快速路由：命中时直接给出策略，不再调用LLM分析
+# 关系/推理类短语 -> 图RAG检索；只收录意图明确的短语，
+# "比较""影响""组合"等常见词单独出现时含义不确定，交给LLM判断；
+# "X和Y比较/相比/的区别"要求X、Y是不含"的"、动词和标点的短词，且位于句末
+_COMPARE_TERM = r"[^\s，,。；;？?的做吃喝煮炒烧蒸炖用是要想买选一]{1,6}"
+GRAPH_FAST_PATH_RE = re.compile(
+    r"为什么|有什么区别|有何区别|区别是什么|(?:搭)?配什么|搭配哪些|"
+    rf"{_COMPARE_TERM}和{_COMPARE_TERM}(?:比较|相比|的区别|的关系)(?:哪个好|怎么样)?[？?。]?$"
+)
+# 单一菜品的做法/食材/步骤查找 -> 传统混合检索
+SIMPLE_FAST_PATH_RE = re.compile(
+    r"^[^，,。；;？?\s]{1,15}(?:怎么做|怎么制作|如何做|的做法|做法|需要哪些食材|需要什么食材|用什么食材|的步骤)[？?。]?$"
+)
+
 class SearchStrategy(Enum):
     """搜索策略枚举"""
     HYBRID_TRADITIONAL = "hybrid_traditional"  # 传统混合检索
     GRAPH_RAG = "graph_rag"  # 图RAG检索
     COMBINED = "combined"  # 组合策略
 
+# 各策略对应的计数键与占比键
+STRATEGY_STAT_KEYS = {
+    SearchStrategy.HYBRID_TRADITIONAL: ("traditional_count", "traditional_ratio"),
+    SearchStrategy.GRAPH_RAG: ("graph_rag_count", "graph_rag_ratio"),
+    SearchStrategy.COMBINED: ("combined_count", "combined_ratio"),
+}
+
 @dataclass
 class QueryAnalysis:
     """查询分析结果"""
@@ -45,21 +67,32 @@ class IntelligentQueryRouter:
             "traditional_count":0,
             "graph_rag_count":0,
             "combined_count":0,
-            "total_queries":0
+            "total_queries":0,
+            "fast_path_count":0, # 规则快速路由命中次数
+            "llm_analysis_count":0 # 调用LLM分析的次数
         }
+        # 多线程并发路由时保护计数器
+        self._stats_lock = threading.Lock()
+
+    def _increment(self, *keys: str):
+        """在锁内累加一个或多个计数器"""
+        with self._stats_lock:
+            for key in keys:
+                self.router_status[key] += 1
 
     def get_route_statistics(self) -> Dict[str, Any]:
         """获取路由统计信息"""
-        total = self.router_status["total_queries"]
+        # 返回快照副本，调用方修改不会影响内部计数
+        with self._stats_lock:
+            stats = dict(self.router_status)
+
+        total = stats["total_queries"]
         if total == 0:
-            return self.router_status
+            return stats
 
-        return {
-            **self.router_status,
-            "traditional_ratio": self.router_status["traditional_count"] / total,
-            "graph_rag_ratio": self.router_status["graph_rag_count"] / total,
-            "combined_ratio": self.router_status["combined_count"] / total
-        }
+        for count_key, ratio_key in STRATEGY_STAT_KEYS.values():
+            stats[ratio_key] = stats[count_key] / total
+        return stats
 
     def explain_routing_decision(self, query: str):
         """解释路由决策过程"""
@@ -89,6 +122,14 @@ class IntelligentQueryRouter:
                 """
         logger.info(f"分析查询特征: {query}")
 
+        # 规则明确时直接路由，省去一次LLM调用
+        analysis = self._fast_path_analysis(query)
+        if analysis is not None:
+            self._increment("fast_path_count")
+            logger.info(f"规则快速路由: {analysis.recommended_strategy.value}")
+            return analysis
+
+        self._increment("llm_analysis_count")
         # 使用LLM进行智能分析
         analysis_prompt = f"""
                 作为RAG系统的查询分析专家，请深度分析以下查询的特征：
@@ -176,6 +217,37 @@ class IntelligentQueryRouter:
             # 降级方案：基于规则的简单分析
             return self._rule_based_analysis(query)
 
+    def _fast_path_analysis(self, query: str) -> Optional[QueryAnalysis]:
+        """
+        基于预编译正则的快速路由，查询特征不明确时返回None交给LLM分析
+        """
+        query = query.strip()
+
+        if SIMPLE_FAST_PATH_RE.match(query):
+            return QueryAnalysis(
+                query_complexity=0.2,
+                relationship_intensity=0.2,
+                reasoning_required=False,
+                entity_count=1,
+                recommended_strategy=SearchStrategy.HYBRID_TRADITIONAL,
+                confidence=0.85,
+                reasoning="规则快速路由：单一菜品的简单信息查找"
+            )
+
+        match = GRAPH_FAST_PATH_RE.search(query)
+        if match:
+            return QueryAnalysis(
+                query_complexity=0.7,
+                relationship_intensity=0.8,
+                reasoning_required=True,
+                entity_count=1,
+                recommended_strategy=SearchStrategy.GRAPH_RAG,
+                confidence=0.8,
+                reasoning=f"规则快速路由：包含关系/推理类短语「{match.group()}」"
+            )
+
+        return None
+
     def _rule_based_analysis(self, query: str) -> QueryAnalysis:
         """基于规则的降级分析"""
         # 简单的规则判断
@@ -242,14 +314,8 @@ class IntelligentQueryRouter:
 
     def _update_route_stats(self, strategy: SearchStrategy):
         """更新路由统计"""
-        self.router_status["total_queries"] += 1
-
-        if strategy == SearchStrategy.HYBRID_TRADITIONAL:
-            self.router_status["traditional_count"] += 1
-        elif strategy == SearchStrategy.GRAPH_RAG:
-            self.router_status["graph_rag_count"] += 1
-        elif strategy == SearchStrategy.COMBINED:
-            self.router_status["combined_count"] += 1
+        count_key, _ = STRATEGY_STAT_KEYS[strategy]
+        self._increment("total_queries", count_key)
 
     def _combined_search(self, query: str, top_k: int) -> List[Document]:
         """
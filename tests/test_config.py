@@ -0,0 +1,31 @@
+import unittest
+
+from config import GraphRAGConfig, LLMConfig, MilvusConfig, Neo4jConfig
+
+
+class GraphRAGConfigTest(unittest.TestCase):
+    """GraphRAGConfig字典序列化"""
+
+    def test_round_trip_restores_nested_configs(self):
+        config = GraphRAGConfig(neo4j_config=Neo4jConfig(uri="bolt://example:7687", password="secret"),
+                                chunk_size=800)
+
+        restored = GraphRAGConfig.from_dict(config.to_dict())
+
+        self.assertIsInstance(restored.neo4j_config, Neo4jConfig)
+        self.assertIsInstance(restored.milvus_config, MilvusConfig)
+        self.assertIsInstance(restored.llm_config, LLMConfig)
+        self.assertEqual(restored.neo4j_config.uri, "bolt://example:7687")
+        self.assertEqual(restored.chunk_size, 800)
+        self.assertEqual(restored, config)
+
+    def test_from_dict_ignores_unknown_keys(self):
+        restored = GraphRAGConfig.from_dict({"chunk_overlap": 20, "unknown": 1,
+                                             "neo4j_config": {"uri": "bolt://x", "unknown": 1}})
+
+        self.assertEqual(restored.chunk_overlap, 20)
+        self.assertEqual(restored.neo4j_config.uri, "bolt://x")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from config import GraphRAGConfig
+from modules.graph_index_module import GraphIndexingModule
+
+HEURISTIC_KEYS = {"REQUIRES", "食材搭配", "烹饪原料", "红烧肉_食材", "五花肉"}
+
+
+class StubLLMClient:
+    """模拟OpenAI客户端，记录调用次数并返回固定的关键词"""
+
+    def __init__(self, content):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self._content = content
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=self._content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class RelationKeysTest(unittest.TestCase):
+    """关系索引键：是否调用LLM增强由enable_llm_relation_keys控制"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.llm_client = StubLLMClient('{"keywords": ["家常菜", "下饭"]}')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _relation_keys(self, enabled):
+        config = GraphRAGConfig(enable_llm_relation_keys=enabled, cache_dir=self._tmp.name)
+        module = GraphIndexingModule(config, self.llm_client)
+        try:
+            return set(module._relation_keys("REQUIRES", "红烧肉", "Recipe", "五花肉", "Ingredient"))
+        finally:
+            if module._llm_key_db is not None:
+                module._llm_key_db.close()
+
+    def test_disabled_uses_heuristic_keys_only(self):
+        self.assertEqual(self._relation_keys(False), HEURISTIC_KEYS)
+        self.assertEqual(self.llm_client.calls, 0)
+
+    def test_enabled_merges_llm_keys(self):
+        self.assertEqual(self._relation_keys(True), HEURISTIC_KEYS | {"家常菜", "下饭"})
+        self.assertEqual(self.llm_client.calls, 1)
+
+    def test_invalid_llm_keywords_are_ignored(self):
+        self.llm_client = StubLLMClient('{"keywords": "家常菜"}')
+        self.assertEqual(self._relation_keys(True), HEURISTIC_KEYS)
+
+
+class EnableLLMRelationKeysEnvTest(unittest.TestCase):
+    """ENABLE_LLM_RELATION_KEYS环境变量解析"""
+
+    def test_env_values(self):
+        cases = {"1": True, "true": True, "YES": True, "0": False, "false": False, "": False}
+        for value, expected in cases.items():
+            with mock.patch.dict(os.environ, {"ENABLE_LLM_RELATION_KEYS": value}):
+                self.assertIs(GraphRAGConfig().enable_llm_relation_keys, expected, value)
+
+    def test_unset_defaults_to_disabled(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("ENABLE_LLM_RELATION_KEYS", None)
+            self.assertFalse(GraphRAGConfig().enable_llm_relation_keys)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from modules.query_router import IntelligentQueryRouter, SearchStrategy
+
+
+class FastPathAnalysisTest(unittest.TestCase):
+    """规则快速路由：只对意图明确的查询直接给出策略"""
+
+    def setUp(self):
+        self.router = IntelligentQueryRouter(config=None, llm_client=None,
+                                             traditional_retrieval=None, graph_retrieval=None)
+
+    def assertStrategy(self, query, strategy):
+        analysis = self.router._fast_path_analysis(query)
+        self.assertIsNotNone(analysis, query)
+        self.assertEqual(analysis.recommended_strategy, strategy, query)
+
+    def test_simple_lookup_routes_to_traditional(self):
+        for query in ["红烧肉怎么做？", "西红柿炒鸡蛋的做法", "宫保鸡丁需要哪些食材"]:
+            self.assertStrategy(query, SearchStrategy.HYBRID_TRADITIONAL)
+
+    def test_relation_phrases_route_to_graph(self):
+        for query in ["为什么川菜用花椒", "鸡肉配什么蔬菜", "生抽和老抽有什么区别", "川菜和湘菜比较",
+                      "鸡胸肉和鸡腿肉相比哪个好", "豆瓣酱和甜面酱的区别"]:
+            self.assertStrategy(query, SearchStrategy.GRAPH_RAG)
+
+    def test_ambiguous_queries_fall_through_to_llm(self):
+        for query in ["推荐几道比较简单的家常菜", "红烧肉怎么做比较好吃", "有什么比较清淡的汤",
+                      "素食组合推荐", "哪些菜对身体有影响", "川菜有哪些特色菜？",
+                      "我想和朋友做一道比较简单的菜", "和家人聚餐做什么比较好",
+                      "适合和孩子一起做的比较容易的菜", "周末和老婆吃什么相比外卖更健康"]:
+            self.assertIsNone(self.router._fast_path_analysis(query), query)
+
+
+if __name__ == "__main__":
+    unittest.main()